@@ -0,0 +1,193 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+
+class PollSnapshot(NamedTuple):
+    '''
+    Everything read in one poll cycle
+    '''
+    cycle: int
+    timestamp: float        # time.time() at the start of the cycle
+    samples: dict           # source name -> latest sample, including ones read in earlier cycles
+    fresh: frozenset        # sources with a new sample since the last snapshot
+    overruns: frozenset     # sources whose read didn't finish within the cycle
+    errors: dict            # source name -> exception raised by a read returning in this cycle
+    duration: float         # seconds until every read returned or the cycle ended
+
+
+class PollEngine(object):
+    '''
+    Read independent instruments in parallel and join the results into one snapshot per cycle
+
+    Every source belongs to a bus, and every bus gets one thread. Sources on the same bus are read one after another
+    in their thread, different buses are read at the same time, so a cycle takes as long as the slowest bus instead
+    of the sum of all of them. Cycles start on fixed monotonic deadlines. A snapshot is published as soon as every
+    bus has returned or the cycle's time is up, whichever comes first.
+
+    A bus that is still busy with an earlier read when its cycle ends is an overrun. It is not read again until it
+    returns, its sources are listed in the snapshot's overruns and counted in `overruns`, and the late result goes
+    into the next snapshot as a fresh sample.
+
+    A source added with every=n is only read every n-th cycle, for instruments that report changes some other way
+    and only need a slow routine poll. request() has such a source read in the next cycle anyway.
+
+    Example::
+
+        engine = PollEngine(0.2, callback=on_snapshot)
+        engine.add_source('power', supply.read, bus='GPIB::8')
+        engine.add_source('temperature', controller.read_snapshot, bus='COM7')
+        engine.start()
+    '''
+
+    def __init__(self, interval=0.2, callback=None):
+        '''
+        :param float, interval: seconds between the starts of two cycles
+        :param callback: called from the engine's thread with the PollSnapshot of every cycle
+        '''
+        self.interval = interval
+        self.callback = callback
+        self.overruns = {}
+        self.latest = None
+        self._buses = {}
+        self._samples = {}
+        self._requested = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_source(self, name, read, bus=None, every=1):
+        '''
+        :param str, name: key of the source's samples in the snapshot
+        :param read: function taking no arguments and returning a sample
+        :param bus: hashable naming the bus the source is on, sources sharing a bus are never read concurrently.
+            Defaults to a bus of its own.
+        :param int, every: read the source every this many cycles
+        '''
+        if self._thread is not None:
+            raise RuntimeError('Sources must be added before the engine is started')
+        bus = name if bus is None else bus
+        group = self._buses.get(bus)
+        if group is None:
+            group = self._buses[bus] = _Bus(bus)
+        group.sources.append((name, read, every))
+        self.overruns[name] = 0
+
+    def set_every(self, name, every):
+        '''
+        Change how often a source is read, taking effect from the next cycle
+        '''
+        for group in self._buses.values():
+            for i, (source, read, _) in enumerate(group.sources):
+                if source == name:
+                    group.sources[i] = (source, read, every)
+                    return
+        raise KeyError(name)
+
+    def request(self, name):
+        '''
+        Read the source in the next cycle even if it isn't due, e.g. after it signalled a change
+        '''
+        self._requested.add(name)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='PollEngine', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop cycling, waiting for reads already on a bus to return
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        for group in self._buses.values():
+            group.executor.shutdown(wait=True)
+            group.reset()
+
+    def _run(self):
+        cycle = 0
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            start = time.monotonic()
+            snapshot = self._cycle(cycle, start, deadline + self.interval)
+            self.latest = snapshot
+            if self.callback is not None:
+                self.callback(snapshot)
+            cycle += 1
+            deadline += self.interval
+            now = time.monotonic()
+            if now > deadline:
+                # skip the cycles that were missed instead of running them back to back
+                deadline += (now - deadline) // self.interval * self.interval
+            self._stop.wait(deadline - now if deadline > now else 0)
+
+    def _cycle(self, cycle, start, deadline):
+        timestamp = time.time()
+        overruns = set()
+        fresh = set()
+        errors = {}
+        submitted = {}
+        requested, self._requested = self._requested, set()
+        for group in self._buses.values():
+            due = [(name, read) for name, read, every in group.sources if cycle % every == 0 or name in requested]
+            if group.future is not None:
+                if not group.future.done():
+                    overruns.update(name for name, read in due)
+                    continue
+                # a read that overran an earlier cycle
+                errors.update(self._collect(group.future.result(), fresh))
+                group.future = None
+            if due:
+                group.future = group.executor.submit(self._read_bus, due)
+                group.reading = [name for name, read in due]
+                submitted[group.future] = group
+        done, not_done = wait(submitted, timeout=max(deadline - time.monotonic(), 0))
+        duration = time.monotonic() - start
+        for future in done:
+            submitted[future].future = None
+            errors.update(self._collect(future.result(), fresh))
+        for future in not_done:
+            overruns.update(submitted[future].reading)
+        for name in overruns:
+            self.overruns[name] += 1
+        return PollSnapshot(cycle, timestamp, dict(self._samples), frozenset(fresh), frozenset(overruns), errors,
+                            duration)
+
+    def _collect(self, results, fresh):
+        errors = {}
+        for name, sample, error in results:
+            if error is None:
+                self._samples[name] = sample
+                fresh.add(name)
+            else:
+                errors[name] = error
+        return errors
+
+    @staticmethod
+    def _read_bus(sources):
+        results = []
+        for name, read in sources:
+            try:
+                results.append((name, read(), None))
+            except Exception as e:
+                results.append((name, None, e))
+        return results
+
+
+class _Bus(object):
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.sources = []
+        self.reset()
+
+    def reset(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'PollEngine {self.bus}')
+        self.future = None
+        self.reading = []
@@ -0,0 +1,137 @@
+import math
+from PyQt6.QtCore import QObject, pyqtSignal
+from acquisition.engine import PollEngine
+from acquisition.samples import ResistivitySample
+from pid_control.scheduler import POLL
+
+
+class InstrumentPoller(QObject):
+    '''
+    Reads the instruments away from the GUI thread and publishes typed samples through Qt signals
+
+    The instruments are read by a PollEngine, one thread per bus: the power supply on GPIB, the water meter stream
+    and each heater controller's serial port, whose reads go through the ModbusScheduler so they queue behind
+    setpoint writes. Signals are emitted from the engine's thread and delivered to the GUI's slots queued, so a slow
+    instrument delays its own samples but never the window. Only samples read in the latest cycle are emitted, the
+    whole PollSnapshot goes out on `snapshot`.
+
+    The power supply reports mode changes and faults by service request, published on `supply_event`, so its routine
+    readback only runs every supply_every cycles, plus once straight after each request. If the interface can't
+    deliver service requests the supply is read every cycle instead.
+
+    Every cycle's values are also appended to the SampleRing passed as ring, one row of RING_COLUMNS per cycle, for
+    consumers that need the numbers rather than the display. A row only holds the samples read in its cycle, and
+    an instrument that wasn't read, e.g. the supply between its routine readbacks, is NaN rather than its previous
+    value repeated. The pump is driven open loop, so its column is the flow rate last commanded, which the app
+    keeps in `flow`.
+    '''
+
+    snapshot = pyqtSignal(object)
+    power_sample = pyqtSignal(object)
+    resistivity_sample = pyqtSignal(object)
+    temperature_sample = pyqtSignal(object)
+    cell_temperature_sample = pyqtSignal(object)
+    supply_event = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+    SIGNALS = {
+        'power': 'power_sample',
+        'resistivity': 'resistivity_sample',
+        'temperature': 'temperature_sample',
+        'cell_temperature': 'cell_temperature_sample',
+    }
+    RING_COLUMNS = ('time', 'voltage', 'current', 'power', 'resistivity', 'temperature', 'cell_temperature', 'flow')
+
+    NAMES = {
+        'power': 'Power supply',
+        'resistivity': 'Water meter',
+        'temperature': 'Heat control',
+        'cell_temperature': 'Cell heat control',
+    }
+
+    def __init__(self, supply, water_meter, controller, scheduler, cell=None, interval=0.2, supply_every=5,
+                 ring=None):
+        '''
+        :param PowerSupply, supply: stack power supply
+        :param WaterMeterStream, water_meter: running water meter stream
+        :param PIDController, controller: heater controller
+        :param ModbusScheduler, scheduler: scheduler all controller transactions go through
+        :param PIDController, cell: cell heater controller, not polled if None
+        :param float, interval: seconds between poll cycles
+        :param int, supply_every: cycles between routine power supply readbacks while service requests are enabled
+        :param SampleRing, ring: ring with RING_COLUMNS the values of every cycle are appended to
+        '''
+        super().__init__()
+        self.supply = supply
+        self.water_meter = water_meter
+        self.controller = controller
+        self.scheduler = scheduler
+        self.cell = cell
+        self.supply_every = supply_every
+        self.ring = ring
+        # commanded pump flow rate, mL/min
+        self.flow = math.nan
+        self.engine = PollEngine(interval, callback=self._publish)
+        self.engine.add_source('power', supply.read, bus=supply.resource_name)
+        self.engine.add_source('resistivity', self.read_resistivity, bus='DAQ')
+        self.engine.add_source('temperature', lambda: self.read_controller(controller), bus=controller.serial.port)
+        if cell is not None:
+            self.engine.add_source('cell_temperature', lambda: self.read_controller(cell), bus=cell.serial.port)
+
+    def start(self):
+        try:
+            self.supply.enable_service_requests(self._on_supply_event,
+                                                error_callback=lambda e: self.error.emit('Power supply: ' + str(e)))
+        except Exception as e:
+            self.error.emit('Power supply: service requests unavailable, polling instead: ' + str(e))
+        else:
+            self.engine.set_every('power', self.supply_every)
+        self.engine.start()
+
+    def stop(self):
+        self.engine.stop()
+        self.supply.disable_service_requests()
+
+    def read_resistivity(self):
+        resistivity, timestamp = self.water_meter.read()
+        if resistivity is None:
+            return None
+        return ResistivitySample(resistivity, timestamp)
+
+    def read_controller(self, controller):
+        # waits for the port's scheduler worker, so polls never cut in ahead of a queued setpoint write
+        return self.scheduler.submit(controller, controller.read_snapshot, priority=POLL).result()
+
+    def _on_supply_event(self, event):
+        self.supply_event.emit(event)
+        self.engine.request('power')
+
+    def _publish(self, snapshot):
+        if self.ring is not None:
+            self.ring.append(self.ring_row(snapshot) + (self.flow,))
+        self.snapshot.emit(snapshot)
+        for name in snapshot.fresh:
+            sample = snapshot.samples[name]
+            if sample is not None:
+                getattr(self, self.SIGNALS[name]).emit(sample)
+        for name, e in snapshot.errors.items():
+            self.error.emit(self.NAMES[name] + ': ' + str(e))
+
+    @staticmethod
+    def ring_row(snapshot):
+        '''
+        The instrument columns of RING_COLUMNS for a snapshot, NaN for the instruments without a fresh sample
+        '''
+        nan = math.nan
+        samples = {name: snapshot.samples.get(name) for name in snapshot.fresh}
+        power = samples.get('power')
+        resistivity = samples.get('resistivity')
+        temperature = samples.get('temperature')
+        cell_temperature = samples.get('cell_temperature')
+        return (snapshot.timestamp,
+                nan if power is None else power.voltage,
+                nan if power is None else power.current,
+                nan if power is None else power.power,
+                nan if resistivity is None else resistivity.resistivity,
+                nan if temperature is None else temperature.pv,
+                nan if cell_temperature is None else cell_temperature.pv)
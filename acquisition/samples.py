@@ -0,0 +1,16 @@
+from typing import NamedTuple
+from pid_control.heater import PIDSnapshot
+from power_control.supply import PowerSnapshot
+
+
+class ResistivitySample(NamedTuple):
+    '''
+    Filtered water resistivity from the water meter stream
+    '''
+    resistivity: float  # MΩ
+    timestamp: float
+
+
+# Power supply and heater controller readings are published as the drivers' own snapshots
+PowerSample = PowerSnapshot
+TemperatureSample = PIDSnapshot
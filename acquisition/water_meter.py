@@ -0,0 +1,106 @@
+import threading
+import time
+import nidaqmx
+import numpy as np
+from nidaqmx.constants import AcquisitionType
+from nidaqmx.stream_readers import AnalogSingleChannelReader
+
+
+class WaterMeterStream(object):
+    '''
+    Continuous, hardware-timed acquisition of the 750II water meter's analog output
+
+    One DAQmx task is created and started once and then runs until closed, sampling the meter on the device's
+    sample clock into the driver's buffer. Every block_size samples the block is read as a numpy array, scaled to
+    resistivity and reduced to a single filtered value, which is kept as `latest` and passed to the callback.
+    Values are delivered at rate / block_size per second.
+
+    Example::
+
+        meter = WaterMeterStream('Dev1/ai6', rate=1000, block_size=500)
+        meter.start()
+        resistivity = meter.latest
+    '''
+
+    # The meter's 0-10 V output reads as resistivity in MΩ after scaling
+    SCALE = 2.0
+    FILTERS = {
+        'mean': np.mean,
+        'median': np.median,
+    }
+
+    def __init__(self, channel, rate=1000.0, block_size=500, filter='mean', callback=None, buffer_blocks=10):
+        '''
+        :param str, channel: analog input channel of the meter, for example, 'Dev1/ai6'
+        :param float, rate: sample clock rate in Hz
+        :param int, block_size: samples per delivered block
+        :param filter: 'mean', 'median' or a function reducing a block of resistivities to one value
+        :param callback: called from the DAQmx callback thread with (value, block) for every block
+        :param int, buffer_blocks: size of the driver's buffer in blocks, headroom for a slow consumer
+        '''
+        self.channel = channel
+        self.rate = rate
+        self.block_size = block_size
+        self.filter = self.FILTERS[filter] if isinstance(filter, str) else filter
+        self.callback = callback
+        self.buffer_blocks = buffer_blocks
+        self.latest = None
+        self.latest_time = None
+        self._task = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        '''
+        Create the task and start sampling
+        '''
+        if self._task is not None:
+            return
+        task = nidaqmx.Task(new_task_name="Resistivity")
+        try:
+            task.ai_channels.add_ai_voltage_chan(self.channel, max_val=10.0, min_val=0.0)
+            task.timing.cfg_samp_clk_timing(self.rate, sample_mode=AcquisitionType.CONTINUOUS,
+                                            samps_per_chan=self.block_size * self.buffer_blocks)
+            self._reader = AnalogSingleChannelReader(task.in_stream)
+            task.register_every_n_samples_acquired_into_buffer_event(self.block_size, self._on_block)
+            task.start()
+        except nidaqmx.DaqError:
+            task.close()
+            raise
+        self._task = task
+
+    def close(self):
+        '''
+        Stop sampling and release the task
+        '''
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.close()
+
+    def read(self):
+        '''
+        Latest filtered resistivity and the time.time() it was delivered at
+        '''
+        with self._lock:
+            return self.latest, self.latest_time
+
+    def _on_block(self, task_handle, every_n_samples_event_type, number_of_samples, callback_data):
+        block = np.empty(self.block_size)
+        self._reader.read_many_sample(block, number_of_samples_per_channel=self.block_size, timeout=0)
+        block *= self.SCALE
+        value = float(self.filter(block))
+        with self._lock:
+            self.latest = value
+            self.latest_time = time.time()
+        if self.callback is not None:
+            self.callback(value, block)
+        # DAQmx expects the callback to return 0
+        return 0
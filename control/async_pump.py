@@ -0,0 +1,256 @@
+import asyncio
+import serial_asyncio
+from control.frames import FrameParser, parse_quantity, parse_dispensed
+from control.pump import PumpProtocol
+from control.utils import NewEraPumpHardwareError, NewEraPumpCommError, NewEraPumpError, NewEraPumpUnitError, convert
+
+
+class AsyncPeristalticPump(PumpProtocol):
+    """
+    asyncio version of PeristalticPump for running pumps from an event loop alongside other instruments
+
+    Commands are coroutines and never block the loop, so one loop can supervise any number of pumps without a
+    thread each, and a running `pump` can be cancelled. Command formatting, response validation and the state cache
+    come from PumpProtocol, shared with PeristalticPump, so only the transport differs. Responses from other
+    addresses on the same line are ignored.
+
+    Example::
+
+        async with AsyncPeristalticPump('COM8') as pump:
+            await pump.set_rate(5)
+            await pump.pump(30, direction='dispense')
+    """
+
+    def __init__(self,
+                 port: str,
+                 address: int = 0,
+                 baudrate: int = 19200,
+                 start_trigger='rising',
+                 stop_trigger='falling',
+                 volume_unit='ml',
+                 rate_unit='ml/min',
+                 safe_start: bool = True,
+                 timeout: float = 0.5,
+                 cache_ttl: float = 1.0,
+                 ):
+        """
+        Parameters are those of PeristalticPump. The port is not opened until `connect` is awaited, or the pump
+        is used as an async context manager.
+        """
+        self._port = port
+        self._baudrate = baudrate
+        self._address = address
+        self._start_trigger = start_trigger
+        self._stop_trigger = stop_trigger
+        self._safe_start = safe_start
+        self.timeout = timeout
+        self.rate_unit = rate_unit
+        self.volume_unit = volume_unit
+        self.rate_unit_cmd = self.REV_RATE_UNIT[rate_unit]
+        self.volume_unit_cmd = self.REV_VOL_UNIT[volume_unit]
+        self.last_turnaround = None
+        self._turnaround = {}
+        self.cache_ttl = cache_ttl
+        self._cache = {}
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._responses = None
+        self._lock = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def connect(self):
+        try:
+            self._reader, self._writer = await serial_asyncio.open_serial_connection(
+                url=self._port, **dict(self.CONNECTION_SETTINGS, baudrate=self._baudrate))
+        except OSError as e:
+            print(e)
+            raise NewEraPumpCommError('SER', self._port)
+        self._responses = asyncio.Queue()
+        self._lock = asyncio.Lock()
+        self._read_task = asyncio.create_task(self._read_loop())
+        try:
+            # Turn audible alarm on.  This will notify the user of any problems with the pump.
+            await self._xmit('AL 1')
+        except NewEraPumpHardwareError as e:
+            # 'R' is the power interrupt alarm returned after the pump is powered on, see PeristalticPump.connect
+            if e.code != 'R':
+                raise
+        if self._safe_start:
+            try:
+                await self.stop()
+            except NewEraPumpCommError:
+                # the pump answers with an error if it wasn't running
+                pass
+        await self.set_trigger(start=self._start_trigger, stop=self._stop_trigger)
+        pump_firmware_version = await self._xmit('VER')
+        print(f'Connected to pump {pump_firmware_version}')
+
+    async def disconnect(self):
+        """
+        Stop pump and close serial port
+        """
+        try:
+            await self.stop()
+        except NewEraPumpError:
+            pass
+        finally:
+            self._read_task.cancel()
+            self._writer.close()
+
+    async def stop(self):
+        """
+        Stop the pump.  Raises NewEraPumpError if the pump is already stopped.
+        """
+        await self._xmit('STP')
+
+    async def start(self):
+        """
+        Starts the pump.
+        """
+        await self._xmit('RUN')
+
+    async def set_trigger(self, start, stop):
+        """
+        Set the start and stop trigger modes, see PeristalticPump.set_trigger
+        """
+        await self._xmit(f'TRG {self.REV_TRIG_MODE[start, stop]}')
+
+    async def set_direction(self, direction):
+        """
+        Set direction of the pump.  Valid directions are 'dispense', 'withdraw'
+        and 'reverse'.
+        """
+        await self._xmit(f'DIR {self.REV_DIR_MODE[direction]}')
+
+    async def get_direction(self):
+        """
+        Get current direction of the pump, either 'dispense' or 'withdraw'
+        """
+        value = await self._query('DIR')
+        return self.DIR_MODE[value.decode(self.STANDARD_ENCODING)]
+
+    async def set_rate(self, rate, unit=None):
+        """
+        Set current rate of the pump, converting rate from specified unit to the
+        unit the interface is set at
+        """
+        await self._xmit(self._rate_command(rate, unit))
+
+    async def get_rate(self, unit=None):
+        """
+        Get current rate of the pump, converting rate to requested unit.  If no
+        unit is specified, value is in the units specified when the interface
+        was created.
+        """
+        value, units = parse_quantity(await self._query('RAT'), 'RAT')
+        if units != self.rate_unit_cmd.encode(self.STANDARD_ENCODING):
+            raise NewEraPumpUnitError(self.rate_unit_cmd, units.decode(self.STANDARD_ENCODING), 'RAT')
+        if unit is not None:
+            value = convert(value, self.rate_unit, unit)
+        return value
+
+    async def _get_dispensed(self, direction, unit=None):
+        dispensed, withdrawn, units = parse_dispensed(await self._xmit_raw('DIS'))
+        if units != self.volume_unit_cmd.encode(self.STANDARD_ENCODING):
+            raise NewEraPumpUnitError(self.volume_unit_cmd, units.decode(self.STANDARD_ENCODING), 'DIS')
+        value = dispensed if direction == 'dispense' else withdrawn
+        if unit is not None:
+            value = convert(value, self.volume_unit, unit)
+        return value
+
+    async def get_dispensed(self, unit=None):
+        """
+        Get current volume dispensed, converting volume to requested unit
+        """
+        return await self._get_dispensed('dispense', unit)
+
+    async def get_withdrawn(self, unit=None):
+        """
+        Get current volume withdrawn, converting volume to requested unit
+        """
+        return await self._get_dispensed('withdraw', unit)
+
+    async def get_status(self):
+        """
+        Get the pump status, from the last response if it is fresh, see PeristalticPump.get_status
+        """
+        status = self._cached('status')
+        if status is None:
+            status = (await self._get_raw_response('')).status
+        return self.STATUS[status]
+
+    async def pump(self,
+                   pump_time: float,
+                   direction: str = None,
+                   wait_time: float = 0,
+                   rate: float = None,
+                   ):
+        """
+        Pump for pump_time seconds, see PeristalticPump.pump. If the task running this is cancelled the pump is
+        stopped before the cancellation propagates.
+        """
+        if rate is not None:
+            await self.set_rate(rate=rate)
+        if direction is not None:
+            await self.set_direction(direction=direction)
+        await self.start()
+        try:
+            await asyncio.sleep(pump_time)
+        finally:
+            # shielded so that a second cancellation can't leave the pump running
+            await asyncio.shield(self.stop())
+        await asyncio.sleep(wait_time)
+
+    #####################################################################
+    # RS232 functions
+    #####################################################################
+
+    async def _read_loop(self):
+        parser = FrameParser()
+        while True:
+            data = await self._reader.read(256)
+            if not data:
+                return
+            for frame in parser.feed(data):
+                if frame.address == self._address:
+                    self._responses.put_nowait(frame)
+
+    async def _get_raw_response(self, command, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        async with self._lock:
+            # drop responses that arrived after an earlier command timed out
+            while not self._responses.empty():
+                self._responses.get_nowait()
+            start = asyncio.get_running_loop().time()
+            self._writer.write(str.encode(str(self._address) + command + ' ' + self.CR))
+            # the command isn't sent until it has left the transport's buffer
+            await self._writer.drain()
+            try:
+                result = await asyncio.wait_for(self._responses.get(), timeout)
+            except asyncio.TimeoutError:
+                result = None
+            self._record_turnaround(command, asyncio.get_running_loop().time() - start)
+        return self.check_response(command, result)
+
+    async def _query(self, command):
+        value = self._cached(command)
+        if value is None:
+            value = await self._xmit_raw(command)
+        return value
+
+    async def _xmit(self, command, timeout=None):
+        """
+        Transmit command to pump and return the <data> of its response, see PeristalticPump._xmit
+        """
+        return (await self._xmit_raw(command, timeout)).decode(self.STANDARD_ENCODING)
+
+    async def _xmit_raw(self, command, timeout=None):
+        return (await self._get_raw_response(command, timeout)).data
@@ -0,0 +1,181 @@
+import atexit
+import queue
+import threading
+import serial
+from control.frames import FrameParser
+from control.pump import PeristalticPump
+from control.utils import NewEraPumpCommError
+
+
+class PumpBus(object):
+    """
+    Share one serial port between several New Era pumps daisy-chained on it
+
+    The bus owns the port and runs a single reader thread that splits the incoming bytes into response frames and
+    routes each frame to the pump whose address it carries. Pumps are driven through the handles returned by
+    `pump`, which behave like a PeristalticPump but never touch the port directly, so commands to different
+    addresses can be in flight at the same time from different threads. If the port fails, the error is kept in
+    `error` and every pump command from then on, including those already waiting for a response, raises
+    NewEraPumpCommError('SER').
+
+    Example::
+
+        bus = PumpBus('COM1')
+        feed = bus.pump(address=0)
+        drain = bus.pump(address=1)
+    """
+
+    # how long the reader thread blocks on the port before checking whether the bus was closed
+    READ_POLL_INTERVAL = 0.05
+
+    def __init__(self, port: str, baudrate: int = 19200):
+        """
+        :param str, port: port the pump chain is connected to, for example, 'COM8'
+        :param int, baudrate: baudrate shared by all pumps on the chain
+        """
+        self.port = port
+        self.baudrate = baudrate
+        settings = dict(PeristalticPump.CONNECTION_SETTINGS, baudrate=baudrate, timeout=self.READ_POLL_INTERVAL)
+        try:
+            self.ser = serial.Serial(port=port, **settings)
+        except serial.SerialException as e:
+            print(e)
+            raise NewEraPumpCommError('SER', port)
+        self._write_lock = threading.Lock()
+        self._channels = {}
+        self.error = None
+        self._running = True
+        self._reader = threading.Thread(target=self._read_loop, name=f'PumpBus {port}', daemon=True)
+        self._reader.start()
+        atexit.register(self.close)
+
+    def pump(self, address: int = 0, **kwargs):
+        """
+        Create a handle for the pump at address on this bus
+
+        :param int, address: address of the pump on the chain
+        :param kwargs: any other PeristalticPump parameter, e.g. rate_unit or timeout
+        :return: BusPump
+        """
+        return BusPump(self, address, **kwargs)
+
+    def close(self):
+        """
+        Stop the reader thread and close the port. Pumps are not stopped; call disconnect on the handles first if
+        that is wanted.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._reader.join()
+        self.ser.close()
+
+    def _open_channel(self, address):
+        if address in self._channels:
+            raise ValueError(f'A pump with address {address} is already connected to {self.port}')
+        channel = _BusChannel(self, address)
+        self._channels[address] = channel
+        return channel
+
+    def _close_channel(self, address):
+        self._channels.pop(address, None)
+
+    def _write(self, data):
+        self.check()
+        # only the write itself is serialized, responses are waited for on each pump's own channel
+        with self._write_lock:
+            try:
+                self.ser.write(data)
+            except serial.SerialException as e:
+                self._fail(e)
+                self.check()
+
+    def check(self):
+        """
+        Raise NewEraPumpCommError if the port has failed
+        """
+        if self.error is not None:
+            raise NewEraPumpCommError('SER', f'{self.port}: {self.error}')
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        # wake the pumps waiting for a response, they find the error instead of timing out
+        for channel in list(self._channels.values()):
+            channel.responses.put(None)
+
+    def _read_loop(self):
+        parser = FrameParser()
+        while self._running:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except serial.SerialException as e:
+                if self._running:
+                    self._fail(e)
+                return
+            for frame in parser.feed(data):
+                channel = self._channels.get(frame.address)
+                if channel is not None:
+                    channel.responses.put(frame)
+
+
+class _BusChannel(object):
+    """
+    Stand-in for the serial port of a single pump on a PumpBus. Provides the part of the serial.Serial interface
+    used by PeristalticPump for writing and connection handling; responses are the frames routed to this address.
+    """
+
+    def __init__(self, bus, address):
+        self.bus = bus
+        self.address = address
+        self.responses = queue.Queue()
+
+    def isOpen(self):
+        return self.bus._running
+
+    def open(self):
+        raise NewEraPumpCommError('SER', f'{self.bus.port} bus is closed')
+
+    def close(self):
+        self.bus._close_channel(self.address)
+
+    def write(self, data):
+        self.bus._write(data)
+
+    def reset_input_buffer(self):
+        while True:
+            try:
+                self.responses.get_nowait()
+            except queue.Empty:
+                return
+
+
+class BusPump(PeristalticPump):
+    """
+    PeristalticPump handle for one address on a PumpBus. Create through PumpBus.pump rather than directly.
+    """
+
+    def __init__(self, bus: PumpBus, address: int = 0, **kwargs):
+        if kwargs.get('read_mode', 'terminator') != 'terminator':
+            raise ValueError('Pumps on a PumpBus only support the terminator read mode')
+        self.bus = bus
+        self._channel = bus._open_channel(address)
+        try:
+            super().__init__(port=bus.port, address=address, baudrate=bus.baudrate, **kwargs)
+        except Exception:
+            self._channel.close()
+            raise
+
+    def connect(self):
+        self.ser = self._channel
+        super().connect()
+
+    def _read_frame(self, timeout):
+        # frames arrive already parsed by the bus reader
+        self.bus.check()
+        try:
+            frame = self._channel.responses.get(timeout=timeout)
+        except queue.Empty:
+            frame = None
+        self.bus.check()
+        return frame
@@ -0,0 +1,141 @@
+import re
+from typing import NamedTuple
+from control.utils import NewEraPumpCommError
+
+#####################################################################
+# Byte-level parsing of New Era pump response frames
+#####################################################################
+
+# The response from the pump always includes a status flag which indicates the pump state (or error). Response is
+# in the format <STX><response data><ETX> where <response data> is in the format <address><status>[<data>].
+# <address> is the pump address, 0 to 99, <status> is one of I, W, S, P, T, U, X or 'A?' for an alarm, and <data>
+# is the answer to a query, '?<error code>' for a command error, or the <alarm type> for an alarm.
+STX = b'\x02'
+ETX = b'\x03'
+
+# <data> can't contain <STX> or <ETX>, so a frame whose end was lost is skipped rather than merged into the next
+_FRAME = re.compile(rb'\x02(\d{1,2})([IWSPTUX]|A\?)([^\x02\x03]*)\x03')
+# status flags but the alarm's 'A?', for splitting a single frame without the regex
+_STATUS = {flag: flag.decode() for flag in (b'I', b'W', b'S', b'P', b'T', b'U', b'X')}
+
+
+class Frame(NamedTuple):
+    """
+    One response frame from the pump
+    """
+    address: int
+    status: str     # one of PeristalticPump.STATUS keys, or 'A?' for an alarm
+    data: bytes
+
+    @property
+    def is_alarm(self):
+        return self.status == 'A?'
+
+    @property
+    def is_error(self):
+        return self.data[:1] == b'?'
+
+
+class FrameParser(object):
+    """
+    Incremental parser turning raw bytes read from the pump into Frames
+
+    Bytes can be fed in arbitrary pieces: a partial frame is kept until the rest of it arrives, several frames in
+    one read are all returned, and noise outside of <STX>...<ETX> is skipped.
+    """
+
+    # number of distinct whole frames kept for reuse
+    RECENT_FRAMES = 64
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # Frames are immutable, so one can be returned any number of times
+        self._recent = {}
+
+    def reset(self):
+        """
+        Discard any partial frame
+        """
+        self._buffer.clear()
+
+    def feed(self, data):
+        """
+        :param bytes, data: bytes read from the pump
+        :return: list of the Frames completed by data, in the order they arrived
+        """
+        if not self._buffer and data[:1] == STX and data[-1:] == ETX:
+            # the usual case of a read holding exactly one whole frame is split without the regex. A pump answers
+            # most commands with one of a few frames, so recent ones are kept and handed out again
+            frame = self._recent.get(data)
+            if frame is None:
+                frame = _whole_frame(data)
+                if frame is not None:
+                    if len(self._recent) >= self.RECENT_FRAMES:
+                        self._recent.clear()
+                    self._recent[data] = frame
+            if frame is not None:
+                return [frame]
+        if self._buffer:
+            self._buffer += data
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        frames = [Frame(int(address), status.decode(), payload) for address, status, payload in _FRAME.findall(data)]
+        # keep a frame that has started but not finished
+        start = data.find(STX, data.rfind(ETX) + 1)
+        if start >= 0:
+            self._buffer += data[start:]
+        return frames
+
+
+def _whole_frame(data):
+    """
+    Split data that starts with <STX> and ends with <ETX> into a Frame
+
+    :return: Frame, or None if data isn't exactly one well-formed frame
+    """
+    if data.count(ETX) != 1 or data.count(STX) != 1:
+        return None
+    # one or two address digits, then the status flag
+    if data[2:3].isdigit():
+        address, start = data[1:3], 3
+    else:
+        address, start = data[1:2], 2
+    status = _STATUS.get(data[start:start + 1])
+    if status is None:
+        if data[start:start + 2] != b'A?':
+            return None
+        status, start = 'A?', start + 1
+    if not address.isdigit():
+        return None
+    return Frame(int(address), status, data[start + 1:-1])
+
+
+#####################################################################
+# Query payloads
+#####################################################################
+
+def parse_quantity(data, command):
+    """
+    Parse a RAT or VOL query answer, <float><units>, e.g. b'2.500MM'
+
+    :return: tuple of the value and the two-letter units as bytes
+    """
+    try:
+        return float(data[:-2]), data[-2:]
+    except ValueError:
+        raise NewEraPumpCommError('COM', command)
+
+
+def parse_dispensed(data):
+    """
+    Parse a DIS query answer, I<float>W<float><volume units>, e.g. b'I1.250W0.000ML'
+
+    :return: tuple of the dispensed volume, withdrawn volume and the two-letter units as bytes
+    """
+    dispensed, separator, withdrawn = data[1:-2].partition(b'W')
+    try:
+        if data[:1] != b'I' or not separator:
+            raise ValueError
+        return float(dispensed), float(withdrawn), data[-2:]
+    except ValueError:
+        raise NewEraPumpCommError('COM', 'DIS')
@@ -1,13 +1,18 @@
-import re
 import warnings
 import serial
+import threading
 import time
+from collections import deque
+from control.frames import FrameParser, parse_quantity, parse_dispensed
 from control.utils import NewEraPumpHardwareError, NewEraPumpCommError, NewEraPumpError, NewEraPumpUnitError, convert
 
-class PeristalticPump(object):
+
+class PumpProtocol(object):
     """
-    Establish a connection with the New Era pump - specifically a peristaltic pump
+    Commands, response validation and the state cache of the New Era pump protocol, independent of the transport
 
+    Shared by PeristalticPump and AsyncPeristalticPump. Subclasses set rate_unit, rate_unit_cmd, volume_unit,
+    volume_unit_cmd, cache_ttl, _cache, _turnaround, last_turnaround and _baudrate.
     """
 
     #####################################################################
@@ -22,6 +27,10 @@ class PeristalticPump(object):
 
     STANDARD_ENCODING = 'UTF-8'
 
+    # Queries whose answers are kept in the state cache, keyed by command mnemonic. The cache is written through by
+    # the matching set commands, so most getters don't need to ask the pump at all.
+    CACHED_QUERIES = ('RAT', 'VOL', 'DIR', 'TRG')
+
     # These are actually the default parameters when calling the command
     # to init the serial port, but are also defined for clarity
     CONNECTION_SETTINGS = dict(
@@ -97,24 +106,133 @@ class PeristalticPump(object):
     # The response from the pump always includes a status flag which indicates
     # the pump state (or error).  Response is in the format
     # <STX><response data><ETX> where <response data> is in the format <address><status>[<data>]
-    # link to resource on understanding regex,compile() is https://docs.python.org/2/library/re.html#re.compile
-    # the way that the regex is used
-    # the (?P<name>...) means that the substring matched by the group is accessible via the symbolic group name
-    # <name>; this means that later it is much easier and readable to access different parts of a match to a regex
-    # expression by searching for the group defined by <name>
-    # for regex, \d means any decimal digit; this is equivalent to the set [0-9], + means one or more
-    # for regex, . means any character except new line, * means zero or more
-    _basic_response = re.compile(STX +
-                                 '(?P<address>\d+)' +
-                                 '(?P<status>[IWSPTUX]|A\?)' +
-                                 '(?P<data>.*)' +
-                                 ETX)
-
-    # Response for queries about volume dispensed.  Returns separate numbers for
-    # dispense and withdraw.  Format is I<float>W<float><volume units>
-    _dispensed = re.compile('I(?P<dispense>[\.0-9]+)' +
-                            'W(?P<withdraw>[\.0-9]+)' +
-                            '(?P<units>OZ|ML)')
+    # Responses are parsed from the raw bytes by control.frames.FrameParser into Frames, and the answers to the
+    # RAT, VOL and DIS queries by parse_quantity and parse_dispensed
+
+    #####################################################################
+    # Command formatting and response validation
+    #####################################################################
+
+    def check_response(self, command, frame):
+        """
+        Raise the error reported by the response frame to command, if any, and return the frame
+
+        :param str, command: the command the frame is the response to
+        :param Frame, frame: the response, or None if the pump did not answer
+        """
+        if frame is None:
+            raise NewEraPumpCommError('NR', command)
+        if frame.is_alarm:
+            # after an alarm (e.g. a reset on power interrupt) none of the cached settings can be trusted
+            self._cache.clear()
+            raise NewEraPumpHardwareError(frame.data.decode(self.STANDARD_ENCODING), command)
+        elif frame.is_error:
+            self._cache['status'] = (frame.status, time.monotonic())
+            raise NewEraPumpCommError(frame.data[1:].decode(self.STANDARD_ENCODING), command)
+        self._update_cache(command, frame.status, frame.data)
+        return frame
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self.cache_ttl:
+            return entry[0]
+        return None
+
+    def _update_cache(self, command, status, data):
+        """
+        Update the state cache from a successful command and its response. Queries store the pump's answer, set
+        commands store the value that was set in the same format the pump would answer with.
+        """
+        now = time.monotonic()
+        mnemonic, _, args = command.partition(' ')
+        if mnemonic == '*RESET':
+            self._cache.clear()
+        self._cache['status'] = (status, now)
+        if mnemonic not in self.CACHED_QUERIES:
+            return
+        args = args.split()
+        if not args:
+            self._cache[mnemonic] = (data, now)
+        elif mnemonic in ('RAT', 'VOL'):
+            if args[0] in self.REV_RATE_UNIT.values() or args[0] in self.REV_VOL_UNIT.values():
+                # a change of units only, the pump converts the value so it has to be asked again
+                self._cache.pop(mnemonic, None)
+            else:
+                units = self.rate_unit_cmd if mnemonic == 'RAT' else self.volume_unit_cmd
+                self._cache[mnemonic] = ((args[0] + units).encode(self.STANDARD_ENCODING), now)
+        elif mnemonic == 'DIR' and args[0] == 'REV':
+            self._cache.pop(mnemonic, None)
+        else:
+            self._cache[mnemonic] = (args[0].encode(self.STANDARD_ENCODING), now)
+
+    def _record_turnaround(self, command, elapsed):
+        self.last_turnaround = elapsed
+        # keyed by the command mnemonic (e.g. 'RAT') and baudrate; '' is the bare status query
+        key = (command.split(' ', 1)[0], self._baudrate)
+        stats = self._turnaround.get(key)
+        if stats is None:
+            self._turnaround[key] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def turnaround_stats(self):
+        """
+        Measured turnaround per command and baudrate since the pump was connected
+
+        :return: dictionary keyed by (command mnemonic, baudrate) with values of dictionaries with the number of
+            commands sent, and the mean and maximum turnaround in seconds
+        """
+        return {key: dict(count=count, mean=total / count, max=worst)
+                for key, (count, total, worst) in self._turnaround.items()}
+
+    def invalidate_cache(self):
+        """
+        Forget all cached pump state, e.g. after settings were changed on the pump's front panel
+        """
+        self._cache.clear()
+
+    @property
+    def last_status(self):
+        """
+        Status flag of the last response from the pump, one of the STATUS keys, without asking the pump and however
+        old it is; None if nothing was heard since the cache was last cleared
+        """
+        entry = self._cache.get('status')
+        return None if entry is None else entry[0]
+
+    def _rate_command(self, rate, unit=None):
+        if unit is not None:
+            rate = convert(rate, unit, self.rate_unit)
+            rate = '%0.3g' % rate  # todo switch all string conversions to this instead
+            return f'RAT {rate} {self.rate_unit_cmd}'
+        rate = '%0.3g' % rate
+        return f'RAT {rate}'
+
+    def _volume_command(self, volume, unit=None):
+        if unit is not None:
+            volume = convert(volume, unit, self.volume_unit)
+            volume = '%0.3g' % volume
+            return f'VOL {volume} {self.volume_unit_cmd}'
+        volume = '%0.3g' % volume
+        return f'VOL {volume}'
+
+
+class PeristalticPump(PumpProtocol):
+    """
+    Establish a connection with the New Era pump - specifically a peristaltic pump
+
+    """
+
+    # Maximum number of commands written ahead of their responses when pipelining a sequence, so that a long
+    # sequence can't overrun the pump's receive buffer
+    PIPELINE_DEPTH = 8
+
+    # 'terminator' reads until the <ETX> of the response frame arrives, 'fixed' is the original behaviour of
+    # sleeping for FIXED_READ_DELAY and then reading whatever is waiting
+    READ_MODES = ('terminator', 'fixed')
+    FIXED_READ_DELAY = 0.03
 
     #####################################################################
     # Special functions for controlling pump
@@ -129,6 +247,10 @@ class PeristalticPump(object):
                  volume_unit='ml',
                  rate_unit='ml/min',
                  safe_start: bool = True,
+                 read_mode: str = 'terminator',
+                 timeout: float = 0.5,
+                 cache_ttl: float = 1.0,
+                 verbose: bool = False,
                  ):
         """
         the pump by default sets the tubing inside diameter to 3/16 inches.
@@ -142,11 +264,36 @@ class PeristalticPump(object):
         :param str, volume_unit: one of VOL_UNIT values
         :param str, rate_unit: one of RATE_UNIT values
         :param bool, safe_start: if True, stop the pump on initialization of the instance
-        """
+        :param str, read_mode: one of READ_MODES. 'terminator' returns as soon as a complete <STX>...<ETX> frame
+            has arrived, 'fixed' waits a fixed pause and then reads whatever the pump has sent so far
+        :param float, timeout: default deadline in seconds for the pump to answer a single command
+        :param float, cache_ttl: how long in seconds a cached rate, volume, direction, trigger or status is answered
+            without asking the pump again. Use 0 to always ask the pump.
+        :param bool, verbose: if True, print every command sent to the pump
+        """
+        if read_mode not in self.READ_MODES:
+            raise ValueError(f'read_mode must be one of {self.READ_MODES}')
         self.ser = None
         self._port = port
         self._baudrate = baudrate
         self._address = address  # for use in code to send commands to the correct address
+        self.read_mode = read_mode
+        self.timeout = timeout
+        self.verbose = verbose
+        # measured command turnaround, in seconds, from writing a command to having its full response
+        self.last_turnaround = None
+        self._turnaround = {}
+        # state cache, maps a CACHED_QUERIES mnemonic or 'status' to (<data> as the pump would answer, time seen)
+        self.cache_ttl = cache_ttl
+        self._cache = {}
+        # bytes read from the pump are parsed incrementally, frames completed ahead of being needed wait in _frames
+        self._parser = FrameParser()
+        self._frames = deque()
+        # one command/response exchange at a time, so the pump can be shared between threads (e.g. a totalizer)
+        self._lock = threading.RLock()
+        # called with no arguments just before the pump's volume counters are cleared, e.g. by a VolumeTotalizer
+        # to take a last reading
+        self.before_counter_clear = []
         self.connect()
         if safe_start:
             # stop the pump on connection
@@ -173,7 +320,8 @@ class PeristalticPump(object):
     def connect(self):
         try:
             if self.ser is None:
-                cn = serial.Serial(port=self._port, **self.CONNECTION_SETTINGS)
+                settings = dict(self.CONNECTION_SETTINGS, baudrate=self._baudrate, timeout=self.timeout)
+                cn = serial.Serial(port=self._port, **settings)
                 self.ser = cn
             if not self.ser.isOpen():
                 self.ser.open()
@@ -217,7 +365,7 @@ class PeristalticPump(object):
         This is a special system command that will be accepted by the pump regardless of its current address.
         :return:
         """
-        self._xmit('*RESET')
+        self._clear_counters('*RESET')
 
     def run(self):
         """
@@ -241,20 +389,27 @@ class PeristalticPump(object):
         """
         Reset the cumulative dispensed and withdrawn volume
         """
-        self.reset_dispensed_volume()
-        self.reset_withdrawn_volume()
+        self._clear_counters('CLD INF', 'CLD WDR')
 
     def reset_dispensed_volume(self):
         """
         Reset the cumulative dispensed volume
         """
-        self._xmit('CLD INF')
+        self._clear_counters('CLD INF')
 
     def reset_withdrawn_volume(self):
         """
         Reset the cumulative withdrawn volume
         """
-        self._xmit('CLD WDR')
+        self._clear_counters('CLD WDR')
+
+    def _clear_counters(self, *commands):
+        # nothing else may reach the pump between the listeners' last reading and the clear
+        with self._lock:
+            for callback in self.before_counter_clear:
+                callback()
+            for command in commands:
+                self._xmit(command)
 
     def pause(self):
         self._trigger = self.get_trigger()
@@ -303,8 +458,8 @@ class PeristalticPump(object):
         Get trigger mode.  Returns tuple of two values indicating start and stop
         condition.
         """
-        value = self._xmit('TRG')
-        return self.TRIG_MODE[value]
+        value = self._query('TRG')
+        return self.TRIG_MODE[value.decode(self.STANDARD_ENCODING)]
 
     def set_direction(self, direction):
         """
@@ -323,8 +478,8 @@ class PeristalticPump(object):
 
         Query response: { INF | WDR }
         """
-        value = self._xmit('DIR')
-        return self.DIR_MODE[value]
+        value = self._query('DIR')
+        return self.DIR_MODE[value.decode(self.STANDARD_ENCODING)]
 
     def get_rate(self, unit=None):
         """
@@ -334,12 +489,10 @@ class PeristalticPump(object):
 
         Query response of RAT: <float><volume units>
         """
-        value = self._xmit('RAT')
-        # last two characters of the <data> from from the <response data> is the units
-        if value[-2:] != self.rate_unit_cmd:
-            raise NewEraPumpUnitError(self.volume_unit_cmd, value[-2:], 'RAT')
-        # everything except the last two characters of the <data> from from the <response data> is the rate
-        value = float(value[:-2])
+        # last two characters of the <data> from from the <response data> is the units, everything before is the rate
+        value, units = parse_quantity(self._query('RAT'), 'RAT')
+        if units != self.rate_unit_cmd.encode(self.STANDARD_ENCODING):
+            raise NewEraPumpUnitError(self.rate_unit_cmd, units.decode(self.STANDARD_ENCODING), 'RAT')
         if unit is not None:
             value = convert(value, self.rate_unit, unit)
         return value
@@ -349,13 +502,7 @@ class PeristalticPump(object):
         Set current rate of the pump, converting rate from specified unit to the
         unit the interface is set at
         """
-        if unit is not None:
-            rate = convert(rate, unit, self.rate_unit)
-            rate = '%0.3g' % rate  # todo switch all string conversions to this instead
-            self._xmit(f'RAT {rate} {self.rate_unit_cmd}')
-        else:
-            rate = '%0.3g' % rate
-            self._xmit(f'RAT {rate}')
+        self._xmit(self._rate_command(rate, unit))
 
     def set_rate_unit(self,
                       rate_unit: str):
@@ -373,14 +520,7 @@ class PeristalticPump(object):
         Set current volume of the pump, converting volume from specified unit to the
         unit the interface is set to
         """
-
-        if unit is not None:
-            volume = convert(volume, unit, self.volume_unit)
-            volume = '%0.3g' % volume
-            self._xmit(f'VOL {volume} {self.volume_unit_cmd}')
-        else:
-            volume = '%0.3g' % volume
-            self._xmit(f'VOL {volume}')
+        self._xmit(self._volume_command(volume, unit))
 
     def set_volume_unit(self,
                         volume_unit: str):
@@ -402,10 +542,9 @@ class PeristalticPump(object):
 
         Query response of VOL: <float><volume units>
         """
-        value = self._xmit('VOL')
-        if value[-2:] != self.volume_unit_cmd:
-            raise NewEraPumpUnitError(self.volume_unit_cmd, value[-2:], 'VOL')
-        value = float(value[:-2])
+        value, units = parse_quantity(self._query('VOL'), 'VOL')
+        if units != self.volume_unit_cmd.encode(self.STANDARD_ENCODING):
+            raise NewEraPumpUnitError(self.volume_unit_cmd, units.decode(self.STANDARD_ENCODING), 'VOL')
         if unit is not None:
             value = convert(value, unit, self.volume_unit)
         return value
@@ -420,15 +559,23 @@ class PeristalticPump(object):
         :param unit:
         :return:
         """
-        result = self._xmit('DIS')
-        match = self._dispensed.match(result)
-        if match.group('units') != self.volume_unit_cmd:
-            raise NewEraPumpUnitError(self.volume_unit_cmd, match.group('units'), 'DIS')
-        else:
-            value = float(match.group(direction))
-            if unit is not None:
-                value = convert(value, self.volume_unit, unit)
-            return value
+        dispensed, withdrawn = self.get_dispensed_volumes(unit)
+        return dispensed if direction == 'dispense' else withdrawn
+
+    def get_dispensed_volumes(self, unit=None):
+        """
+        Get both the current volume dispensed and withdrawn from a single DIS query, converting volumes to the
+        requested unit.
+
+        :return: tuple of the dispensed and withdrawn volume
+        """
+        dispensed, withdrawn, units = parse_dispensed(self._xmit_raw('DIS'))
+        if units != self.volume_unit_cmd.encode(self.STANDARD_ENCODING):
+            raise NewEraPumpUnitError(self.volume_unit_cmd, units.decode(self.STANDARD_ENCODING), 'DIS')
+        if unit is not None:
+            dispensed = convert(dispensed, self.volume_unit, unit)
+            withdrawn = convert(withdrawn, self.volume_unit, unit)
+        return dispensed, withdrawn
 
     def get_dispensed(self, unit=None):
         """
@@ -473,9 +620,38 @@ class PeristalticPump(object):
         else:
             raise NewEraPumpCommError('', 'IN 2')
 
+    def configure(self, rate=None, direction=None, volume=None, trigger=None, unit=None):
+        """
+        Set any of the rate, direction, volume and trigger in a single pipelined exchange with the pump instead of
+        one round trip per setting. Parameters left as None are not changed.
+
+        :param float, rate: pumping rate, see set_rate
+        :param str, direction: one of 'dispense', 'withdraw', or 'reverse'
+        :param float, volume: volume to pump, see set_volume
+        :param tuple, trigger: (start, stop) trigger pair, see set_trigger
+        :param str, unit: rate unit for rate; volume is given in the interface's volume unit
+        """
+        commands = []
+        if rate is not None:
+            commands.append(self._rate_command(rate, unit))
+        if direction is not None:
+            commands.append(f'DIR {self.REV_DIR_MODE[direction]}')
+        if volume is not None:
+            commands.append(self._volume_command(volume))
+        if trigger is not None:
+            commands.append(f'TRG {self.REV_TRIG_MODE[tuple(trigger)]}')
+        self._xmit_sequence(*commands, pipelined=True)
+
     def get_status(self):
-        return self.STATUS[self._get_raw_response('')['status']]
-    
+        """
+        Get the pump status. Every response from the pump carries its status, so the pump is only asked when
+        nothing has been heard from it within cache_ttl.
+        """
+        status = self._cached('status')
+        if status is None:
+            status = self._get_raw_response('').status
+        return self.STATUS[status]
+
     def beep(self):
         self._xmit('BUZ 1 1')
 
@@ -485,41 +661,114 @@ class PeristalticPump(object):
 
     def _readline(self):
         bytesToRead = self.ser.inWaiting()
-        response = self.ser.read(bytesToRead)
-        response = response.decode(self.STANDARD_ENCODING)
-        return response
+        self._frames.extend(self._parser.feed(self.ser.read(bytesToRead)))
+        return self._frames.popleft() if self._frames else None
+
+    def _discard_input(self):
+        self.ser.reset_input_buffer()
+        self._parser.reset()
+        self._frames.clear()
+
+    def _read_frame(self, timeout):
+        """
+        Read until a complete response frame has arrived, or until timeout seconds have passed
+
+        :return: Frame, or None if no complete frame arrived in time
+        """
+        deadline = time.monotonic() + timeout
+        etx = self.ETX.encode(self.STANDARD_ENCODING)
+        while not self._frames:
+            # changing the timeout reconfigures the port, so only do it when the deadline actually differs
+            if self.ser.timeout != timeout:
+                self.ser.timeout = timeout
+            data = self.ser.read_until(etx)
+            self._frames.extend(self._parser.feed(data))
+            timeout = deadline - time.monotonic()
+            if not self._frames and (not data.endswith(etx) or timeout <= 0):
+                return None
+        return self._frames.popleft()
 
-    def _xmit_sequence(self, *commands):
+    def _xmit_sequence(self, *commands, pipelined=False, timeout=None):
         """
         Transmit sequence of commands to pump and return a dictionary containing all the named subgroups of the
         match, with the subgroup as the key and the matched string as the value; the responses to each of the
         commands are the values in this case
-        """
-        return [self._xmit(cmd) for cmd in commands]
 
-    def _get_raw_response(self, command):
-        self._send(command)
-        time.sleep(0.03)  # need a small pause for the pump to actually have a response to send back
-        result = self._readline()
+        If pipelined is True, up to PIPELINE_DEPTH commands are written back to back before their responses are
+        read and matched to the commands in order. Every response of the batch is read before an error is raised,
+        so the error is the one for the first command that failed and no stray frames are left on the port.
+        Pipelining needs the terminator read mode; in the fixed read mode the commands are sent one at a time.
+        """
+        if not pipelined or self.read_mode != 'terminator':
+            return [self._xmit(cmd, timeout) for cmd in commands]
+        responses = []
+        for i in range(0, len(commands), self.PIPELINE_DEPTH):
+            batch = commands[i:i + self.PIPELINE_DEPTH]
+            responses.extend(response.data.decode(self.STANDARD_ENCODING)
+                             for response in self._get_raw_responses(batch, timeout))
+        return responses
+
+    def _get_raw_responses(self, commands, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        responses = []
+        error = None
+        with self._lock:
+            self._discard_input()
+            start = time.perf_counter()
+            self._send(*commands)
+            for command in commands:
+                result = self._read_frame(timeout)
+                # the turnaround of a pipelined command is the time since the previous response arrived
+                now = time.perf_counter()
+                self._record_turnaround(command, now - start)
+                start = now
+                try:
+                    responses.append(self.check_response(command, result))
+                except NewEraPumpError as e:
+                    if error is None:
+                        error = e
+                    if result is None:
+                        # nothing arrived before the deadline, so the later responses won't either
+                        break
+        if error is not None:
+            raise error
+        return responses
+
+    def _get_raw_response(self, command, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        with self._lock:
+            start = time.perf_counter()
+            if self.read_mode == 'terminator':
+                # drop anything left over from an earlier command that timed out so it can't be taken as this response
+                self._discard_input()
+                self._send(command)
+                result = self._read_frame(timeout)
+            else:
+                self._send(command)
+                # need a small pause for the pump to actually have a response to send back
+                time.sleep(self.FIXED_READ_DELAY)
+                result = self._readline()
+            self._record_turnaround(command, time.perf_counter() - start)
         # I think that this result == '' check should be ignored because when setting parameters like VOL or DIR or
         # RAT, there won't be a <dada> in the <response data> sent back unless there was an actual error,
         # and when that happens the other catches should catch that
-        # if result == '':
+        # if result is None:
         #     raise NewEraPumpCommError('NR', command)
         response = self.check_response(command, result)
         return response
 
-    def check_response(self, command, result):
-        match = self._basic_response.match(result)
-        if match is None:
-            raise NewEraPumpCommError('NR')
-        if match.group('status') == 'A?':
-            raise NewEraPumpHardwareError(match.group('data'), command)
-        elif match.group('data').startswith('?'):
-            raise NewEraPumpCommError(match.group('data')[1:], command)
-        return match.groupdict()
+    def _query(self, command):
+        """
+        Answer a query from the state cache if it is fresh, otherwise transmit it
+        """
+        value = self._cached(command)
+        if value is None:
+            value = self._xmit_raw(command)
+        return value
 
-    def _xmit(self, command):
+    def _xmit(self, command, timeout=None):
         """
         Transmit command to pump and return response
 
@@ -531,14 +780,26 @@ class PeristalticPump(object):
         condition (e.g. a stall or power reset).  If so, the appropriate
         exception is raised. But if there is no error and the command sent was to query instead of set a parameter
         for the pump, then the response packet sent back will have the result of the query.
+
+        timeout overrides the default response deadline for this command only.
         """
-        return self._get_raw_response(command)['data']
+        return self._xmit_raw(command, timeout).decode(self.STANDARD_ENCODING)
 
-    def _send(self, command):
-        formatted_command = str(self._address) + command + ' ' + self.CR
-        encoded_formatted_command = str.encode(formatted_command)
-        print(f'send command {formatted_command}')
-        self.ser.write(encoded_formatted_command)
+    def _xmit_raw(self, command, timeout=None):
+        """
+        Same as _xmit, but return the response <data> as the bytes received
+        """
+        return self._get_raw_response(command, timeout).data
+
+    def _send(self, *commands):
+        """
+        Write one or more commands to the pump in a single write
+        """
+        formatted_commands = [str(self._address) + command + ' ' + self.CR for command in commands]
+        if self.verbose:
+            for formatted_command in formatted_commands:
+                print(f'send command {formatted_command}')
+        self.ser.write(str.encode(''.join(formatted_commands)))
 
     #####################################################################
     # Convenience functions and other functions
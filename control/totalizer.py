@@ -0,0 +1,149 @@
+import threading
+import time
+
+# US fluid ounce, for pumps whose rate and volume units mix ounces and millilitres
+ML_PER_OZ = 29.5735
+
+
+class VolumeTotalizer(object):
+    """
+    Keep running totals of the volume dispensed and withdrawn by a PeristalticPump
+
+    A background thread sends one DIS query per interval, which answers both directions at once. Totals carry on
+    across anything that clears the pump's own counters (reset_volume, *RESET, a power interrupt): a counter that
+    goes down is taken as cleared and its previous value is kept. While running, the totalizer also reads the
+    counters just before the pump clears them itself, so the volume pumped since the last poll isn't lost. Between
+    polls the totals are extrapolated from the pump's rate and the status of the DIS response, so they can be read
+    as often as wanted without any serial traffic.
+
+    Example::
+
+        totalizer = VolumeTotalizer(pump, interval=1.0)
+        totalizer.start()
+        dispensed, withdrawn = totalizer.totals()
+    """
+
+    def __init__(self, pump, interval: float = 1.0):
+        """
+        :param PeristalticPump, pump: pump to follow; totals are in its volume unit
+        :param float, interval: seconds between DIS queries
+        """
+        self.pump = pump
+        self.interval = interval
+        self.last_error = None
+        self._lock = threading.Lock()
+        # volume counted before the pump's counters were last cleared, and the last counter readings
+        self._offset = [0.0, 0.0]
+        self._reading = None
+        self._polled_at = None
+        self._status = None
+        self._flow = 0.0    # volume unit per second
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start polling the pump in the background
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.pump.before_counter_clear.append(self._before_clear)
+        self._thread = threading.Thread(target=self._run, name='VolumeTotalizer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop polling. The totals keep their last polled value.
+        """
+        self._stop.set()
+        if self._before_clear in self.pump.before_counter_clear:
+            self.pump.before_counter_clear.remove(self._before_clear)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._status = None
+
+    def reset(self):
+        """
+        Zero the totals. The pump's own counters are not touched.
+        """
+        with self._lock:
+            if self._reading is None:
+                self._offset = [0.0, 0.0]
+            else:
+                self._offset = [-self._reading[0], -self._reading[1]]
+
+    def poll(self):
+        """
+        Read the pump's counters, rate and status now. Called by the background thread every interval.
+        """
+        reading = self.pump.get_dispensed_volumes()
+        # the status is that of the DIS response, and the rate only costs a query when it is stale
+        status = self.pump.last_status
+        flow = self._flow_per_second(self.pump.get_rate())
+        with self._lock:
+            if self._reading is not None:
+                for i in (0, 1):
+                    if reading[i] < self._reading[i]:
+                        self._offset[i] += self._reading[i]
+            self._reading = reading
+            self._polled_at = time.monotonic()
+            self._status = status
+            self._flow = flow
+
+    def totals(self):
+        """
+        Cumulative volume dispensed and withdrawn, in the pump's volume unit, extrapolated to now
+
+        :return: tuple of the dispensed and withdrawn volume
+        """
+        with self._lock:
+            if self._reading is None:
+                return tuple(self._offset)
+            dispensed = self._offset[0] + self._reading[0]
+            withdrawn = self._offset[1] + self._reading[1]
+            # don't extrapolate far past a poll that failed or hasn't happened yet
+            elapsed = min(time.monotonic() - self._polled_at, 2 * self.interval)
+            if self._status == 'I':
+                dispensed += self._flow * elapsed
+            elif self._status == 'W':
+                withdrawn += self._flow * elapsed
+            return dispensed, withdrawn
+
+    @property
+    def dispensed(self):
+        return self.totals()[0]
+
+    @property
+    def withdrawn(self):
+        return self.totals()[1]
+
+    def _flow_per_second(self, rate):
+        """
+        Convert a rate in the pump's rate unit to its volume unit per second
+        """
+        volume, per = self.pump.rate_unit.split('/')
+        if per == 'min':
+            rate /= 60.0
+        if volume != self.pump.volume_unit:
+            rate = rate * ML_PER_OZ if volume == 'Oz' else rate / ML_PER_OZ
+        return rate
+
+    def _before_clear(self):
+        try:
+            self.poll()
+        except Exception as e:
+            # the counters are cleared anyway; the volume since the last poll is then lost
+            self.last_error = e
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:
+                # a unit mismatch or a serial error must not end the thread and freeze the totals
+                self.last_error = e
+            self._stop.wait(self.interval)
@@ -12,16 +12,27 @@ from PyQt6.QtGui import QDoubleValidator, QPixmap
 from PyQt6.QtCore import QObject, QThread, pyqtSignal, QRunnable, pyqtSlot
 
 #Import basic libraries
-from decimal import Decimal
 from pid_control import heater
+from pid_control.scheduler import ModbusScheduler, WRITE
+from acquisition.water_meter import WaterMeterStream
+from acquisition.poller import InstrumentPoller
+from power_control.supply import PowerSupply
+from telemetry.logger import TelemetryLogger
+from telemetry.ring import SampleRing
+from telemetry.store import RunStore
+from telemetry.rollup import RollupPipeline
+from trend_plots import TrendPlots
+from program.scheduler import StepScheduler
+from program.ramps import expand
+from program.compiler import compile_program, ProgramError, COLUMNS
+from program.dispatcher import SetpointDispatcher
+import numpy as np
 import nidaqmx
 import time
-import csv
+import threading
 import pyvisa
-import re
 import sys
 import os
-import pandas as pd
 import serial
 from minimalmodbus import NoResponseError
 from uuid import uuid4, UUID
@@ -32,10 +43,24 @@ device_list = {
     "Water Meter": "Dev1/ai6"
 }
 
+#Set ELECTRO_EMULATE=1 to run against emulated instruments on this machine instead of the bench (Linux only)
+#Every instrument then answers after ELECTRO_EMULATE_DELAY seconds (default 0.005), give or take ELECTRO_EMULATE_JITTER
+if os.environ.get("ELECTRO_EMULATE"):
+    from emulators.bench import Bench
+    import acquisition.water_meter
+    bench = Bench(delay=float(os.environ.get("ELECTRO_EMULATE_DELAY", 0.005)),
+                  jitter=float(os.environ.get("ELECTRO_EMULATE_JITTER", 0.002)))
+    rm = bench.resource_manager
+    nidaqmx = bench.daq.module
+    bench.daq.install(acquisition.water_meter)
+    heater_port, cell_port = bench.heater.port, bench.cell.port
+else:
+    rm = pyvisa.ResourceManager()
+    heater_port, cell_port = 'COM7', 'COM6'
+
 #Globally define power supply and pump serial address
-rm = pyvisa.ResourceManager()
 try:
-    instr = rm.open_resource("GPIB::8::INSTR")
+    supply = PowerSupply(rm.open_resource("GPIB::8::INSTR"))
 except pyvisa.errors.VisaIOError:
     sys.exit("Error: Power supply not connected.")
 pump_port = "COM1"
@@ -44,17 +69,30 @@ devices = {
     "Water Resist": "Dev1/ai6"
 }
 
+#Setpoint ranges and decimals accepted from the settings tabs; program files are checked against the same ranges
+setpoint_limits = {
+    "voltage": (0.000, 61.425, 3),
+    "current": (0.000, 1000.000, 3),
+    "flow": (0.00, 2000.00, 2),
+    "temperature": (0.00, 100.00, 2)
+}
+
 #PID heat control connection check
-controller = heater.OmegaPID('COM7', 247)
+#Setpoint writes are read back by the instrument poller's next snapshot instead of straight after the write
+controller = heater.OmegaPID(heater_port, 247, verify='deferred', on_mismatch=lambda e: print('Heat control: ' + str(e)))
 try:
     controller.status_check()
 except NoResponseError:
     sys.exit("Error: Heat controller disconnected or on incorrect port.")
-cell = heater.DeltaPID('COM6', 1)
+cell = heater.DeltaPID(cell_port, 1)
 if cell.serial is None:
     raise ValueError("Instrument.serial is none")
 cell.serial.baudrate = 19200
 
+#All heat control transactions go through the scheduler, so GUI writes and background polls never collide on a port
+#Setpoint writes are submitted with a key per controller, so one still queued is sent with the newest value instead
+scheduler = ModbusScheduler()
+
 #Tasks for controlling the pump
 def pump_start_stop():
     pump_start_task = nidaqmx.Task(new_task_name="Pump Start")
@@ -66,28 +104,83 @@ def pump_flow():
     pump_flow_task.ao_channels.add_ao_voltage_chan(device_list["Pump Analog"], min_val=0.0, max_val=10.0)
     return pump_flow_task
 
+#Runs compiled program files step by step. Columns are duration (s), voltage (V), current (mA), flow (mL/min),
+#temperature (°C) and an optional ramp: blank or 'step' sets the values at the start of the row, 'linear' or 'exp'
+#ramps to them from the previous row's values over the row's duration. Ramps are precomputed and sent ramp_rate times
+#a second; every update is emitted as [duration, voltage, current, flow, temperature] when it is due.
+#cancel, pause and resume are called directly from the GUI thread while run_program blocks this one. They are kept as
+#flags until the step scheduler exists, so a Terminate or Pause clicked before the run has started still applies to it.
 class Worker(QObject):
 
     started = pyqtSignal()
     progress = pyqtSignal(list)
+    step_report = pyqtSignal(object)
     finished = pyqtSignal()
 
-    @pyqtSlot(list)
-    def run_program(self, files: list[str]):
+    def __init__(self, ramp_rate=1.0):
+        super().__init__()
+        self.ramp_rate = ramp_rate
+        self.scheduler = None
+        self.cancelled = False
+        self.paused = False
+        self._lock = threading.Lock()
+
+    #Called from the GUI thread before the run is requested, clearing the flags of the previous run
+    def prepare(self):
+        with self._lock:
+            self.scheduler = None
+            self.cancelled = False
+            self.paused = False
+
+    @pyqtSlot(object)
+    def run_program(self, program):
         self.started.emit()
-        self.files_to_process = files
-        with open(self.files_to_process[0], newline='') as csvfile:
-            self.reader = csv.reader(csvfile)
-            next(self.reader, None)
-            for row in self.reader:
-                self.progress.emit(row)
-                time.sleep(int(row[0]))
+        row_durations = program.durations.tolist()
+        durations, values, tick_rows = expand(program.durations, program.values, program.shapes, self.ramp_rate)
+        #only the first update of each row is reported, as the start of that row
+        first_tick = np.r_[True, tick_rows[1:] != tick_rows[:-1]]
+
+        def step(tick):
+            self.progress.emit([row_durations[tick_rows[tick]]] + values[tick].tolist())
+
+        def report(tick_report):
+            if first_tick[tick_report.index]:
+                self.step_report.emit(tick_report._replace(index=int(tick_rows[tick_report.index])))
+
+        scheduler = StepScheduler(durations, step, on_report=report)
+        with self._lock:
+            self.scheduler = scheduler
+            if self.cancelled:
+                scheduler.cancel()
+            if self.paused:
+                scheduler.pause()
+        scheduler.run()
         self.finished.emit()
 
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self.scheduler is not None:
+                self.scheduler.cancel()
+
+    def pause(self):
+        with self._lock:
+            self.paused = True
+            if self.scheduler is not None:
+                self.scheduler.pause()
+
+    def resume(self):
+        with self._lock:
+            self.paused = False
+            if self.scheduler is not None:
+                self.scheduler.resume()
+
 #Defining the main UI window
 class UI_Setup(QMainWindow):
 
-    work_requested = pyqtSignal(list)
+    work_requested = pyqtSignal(object)
+    #Program step writes fail on the dispatcher's bus threads and are shown from the GUI thread
+    dispatch_error = pyqtSignal(str)
     #Initialize the main UI. Construct main UI window, graphics of system process flow, and settings for all controlled variables.
     def __init__(self):
         super().__init__()
@@ -103,6 +196,7 @@ class UI_Setup(QMainWindow):
 
         self.worker.started.connect(self.handle_started)
         self.worker.progress.connect(self.handle_update)
+        self.worker.step_report.connect(self.handle_step_report)
         self.worker.finished.connect(self.handle_finished)
 
         self.work_requested.connect(self.worker.run_program)
@@ -112,6 +206,7 @@ class UI_Setup(QMainWindow):
         self.worker_running = bool()
 
         self.files_to_process = []
+        self.program = None
 
         #Construct base layout for window
         layout = QtWidgets.QVBoxLayout()
@@ -207,6 +302,11 @@ class UI_Setup(QMainWindow):
         self.term_btn.setEnabled(False)
         self.term_btn.clicked.connect(self.term_btn_clicked)
 
+        self.pause_btn = QtWidgets.QPushButton("Pause Program")
+        self.pause_btn.setCheckable(True)
+        self.pause_btn.setEnabled(False)
+        self.pause_btn.toggled.connect(self.pause_btn_toggled)
+
         #Tabs containing settings
         self.tabs = QtWidgets.QTabWidget()
         self.tabs.addTab(self.elec_UI(), "Power Control")
@@ -220,6 +320,7 @@ class UI_Setup(QMainWindow):
         layout.addWidget(self.term_btn)
         layout.addWidget(self.program_btn)
         layout.addWidget(self.run_btn)
+        layout.addWidget(self.pause_btn)
 
         #Dict for storing settings during operation
         self.settings = {
@@ -257,7 +358,7 @@ class UI_Setup(QMainWindow):
 
         #Space to enter settings before writing to power supply
         self.V_Write = QtWidgets.QLineEdit()
-        self.V_Validate = QDoubleValidator(0.000, 61.425, 3)
+        self.V_Validate = QDoubleValidator(*setpoint_limits['voltage'])
         self.V_Validate.setNotation(QDoubleValidator.Notation.StandardNotation)
         self.V_Write.setValidator(self.V_Validate)
         self.V_Write.setFont(font)
@@ -266,7 +367,7 @@ class UI_Setup(QMainWindow):
         layout.addWidget(self.V_Write, 1, 0)
 
         self.I_Write = QtWidgets.QLineEdit()
-        self.I_Validate = QDoubleValidator(0.000, 1000.000, 3)
+        self.I_Validate = QDoubleValidator(*setpoint_limits['current'])
         self.I_Validate.setNotation(QDoubleValidator.Notation.StandardNotation)
         self.I_Write.setValidator(self.I_Validate)
         self.I_Write.setFont(font)
@@ -315,7 +416,7 @@ class UI_Setup(QMainWindow):
         layout.addWidget(self.Flow_Text, 0, 0)
 
         self.Flow_Write = QtWidgets.QLineEdit()
-        self.Flow_Validate = QDoubleValidator(0.00, 2000.00, 2)
+        self.Flow_Validate = QDoubleValidator(*setpoint_limits['flow'])
         self.Flow_Validate.setNotation(QDoubleValidator.Notation.StandardNotation)
         self.Flow_Write.setValidator(self.Flow_Validate)
         self.Flow_Write.setFont(font)
@@ -346,7 +447,7 @@ class UI_Setup(QMainWindow):
         layout.addWidget(self.Temp_Text, 0, 0)
 
         self.Temp_Set = QtWidgets.QLineEdit()
-        self.Temp_Validate = QDoubleValidator(0.00, 100.00, 2)
+        self.Temp_Validate = QDoubleValidator(*setpoint_limits['temperature'])
         self.Temp_Validate.setNotation(QDoubleValidator.Notation.StandardNotation)
         self.Temp_Set.setValidator(self.Temp_Validate)
         self.Temp_Set.setFont(font)
@@ -364,19 +465,18 @@ class UI_Setup(QMainWindow):
             self.run_btn.setDisabled(True)
 
         self.Running = 'Initialization'
-        timer_2.setInterval(5 * 1000)
 
         #Writing voltage to power supply
         v = self.V_Write.text()
         if v == "" and self.V_Write.placeholderText() == "0.00 V":
             pass
         elif v == "":
-            instr.write('VSET' + str(self.settings['Voltage']))
+            supply.set_voltage(self.settings['Voltage'])
         else:
             try:
                 v_f = float(v)
                 self.settings['Voltage'] = v_f
-                instr.write('VSET ' + str(self.settings['Voltage']))
+                supply.set_voltage(self.settings['Voltage'])
                 self.V_Write.setPlaceholderText(self.V_Write.text() + " V")
             except ValueError:
                 print('Invalid Entry')
@@ -387,12 +487,12 @@ class UI_Setup(QMainWindow):
         if s == "" and self.I_Write.placeholderText() == "0.00 mA":
             pass
         elif s == "":
-            instr.write('ISET' + str(self.settings['Current']) + ' MA')
+            supply.set_current(self.settings['Current'] / 1000)
         else:
             try:
                 s_f = float(s)
                 self.settings['Current'] = s_f
-                instr.write('ISET ' + str(self.settings['Current']) + ' MA')
+                supply.set_current(self.settings['Current'] / 1000)
                 self.I_Write.setPlaceholderText(self.I_Write.text() + " mA")
             except ValueError:
                 print("Invalid Entry")
@@ -403,13 +503,13 @@ class UI_Setup(QMainWindow):
         if f == "" and self.Flow_Write.placeholderText() == "0.00 mL/min":
             pass
         elif f == "":
-            set_rate.write(self.settings['Flow'] / 60)
+            write_flow(self.settings['Flow'])
             pump_on.write(False)
             self.flow_val.setText(str(self.settings['Flow']))
         else:
             try:
                 f_f = float(f)
-                set_rate.write(f_f / 60)
+                write_flow(f_f)
                 if f_f == 0:
                     pass
                 else:
@@ -426,13 +526,13 @@ class UI_Setup(QMainWindow):
         if t == "" and self.Temp_Set.placeholderText() == "0.00 °C":
             pass
         elif t == "":
-            controller.set_sp_loop1(self.settings['Temp'])
+            scheduler.submit(controller, controller.set_sp_loop1, self.settings['Temp'], priority=WRITE, key=('sp', controller.address))
         else:
             try:
                 t_f = float(t)
                 self.settings['Temp'] = t_f
-                controller.set_sp_loop1(self.settings['Temp'])
-                cell.set_sp(int(self.settings['Temp']) * 10)
+                scheduler.submit(controller, controller.set_sp_loop1, self.settings['Temp'], priority=WRITE, key=('sp', controller.address))
+                scheduler.submit(cell, cell.set_sp, int(self.settings['Temp']) * 10, priority=WRITE, key=('sp', cell.address))
                 self.Temp_Set.setPlaceholderText(str(self.settings['Temp']) + ' °C')
             except ValueError:
                 print('Invalid Entry')
@@ -448,16 +548,15 @@ class UI_Setup(QMainWindow):
             self.term_btn.setEnabled(True)
 
     #This slot triggers when the termination button is clicked.
-    #All instruments are set to 0, the logging timer returns to standby, and the commit button is enabled again.
+    #All instruments are set to 0 and the commit button is enabled again.
     def term_btn_clicked(self):
-        timer_2.setInterval(300 * 1000)
-        instr.write('VSET 0')
-        instr.write('ISET 0')
-        set_rate.write(0)
+        #cancelled even if the run hasn't reported its start yet, and its queued step writes dropped before zeroing
+        self.worker.cancel()
+        dispatcher.cancel()
+        supply.zero()
+        write_flow(0)
         pump_on.write(True)
-        controller.set_sp_loop1(0)
-        if self.worker_running == True:
-            self.worker_thread.quit()
+        scheduler.submit(controller, controller.set_sp_loop1, 0, priority=WRITE, key=('sp', controller.address))
 
         self.Running = 'Standby'
         self.term_btn.setEnabled(False)
@@ -467,56 +566,120 @@ class UI_Setup(QMainWindow):
 
     #This slot triggers when the flow stop button is pressed. Immediately stops pump flow.
     def stop_flow(self):
-        set_rate.write(0)
+        write_flow(0)
         pump_on.write(True)
         
     def start_worker(self):
         self.commit_btn.setDisabled(True)
         self.term_btn.setEnabled(True)
         self.program_btn.setDisabled(True)
-        self.work_requested.emit(self.files_to_process)
+        #The first step of a program writes every setpoint, whatever was set by hand before it
+        dispatcher.reset()
+        self.worker.prepare()
+        self.work_requested.emit(self.program)
+
+    #This slot triggers when the pause button is toggled. The running step's remaining time is kept while paused.
+    def pause_btn_toggled(self, paused):
+        if paused:
+            self.worker.pause()
+            self.pause_btn.setText("Resume Program")
+        else:
+            self.worker.resume()
+            self.pause_btn.setText("Pause Program")
 
     #def system_check(self):
         #check if levels are good before initializing system
 
     #This slot triggers when the program is closed. All instruments are set to zero and the timers are disabled.
     def closeEvent(self, event):
-        timer_1.stop()
+        #No program step may be written after the instruments are made safe below
+        self.worker.cancel()
+        dispatcher.close()
+        poller.stop()
         timer_2.stop()
-        instr.write('VSET 0')
-        instr.write('ISET 0')
-        set_rate.write(0)
+        datalog(log_reader, self.settings['Temp'])
+        log.close()
+        archive(store_reader)
+        store.close()
+        rollups.close()
+        supply.zero()
+        write_flow(0)
         pump_on.write(True)
         set_rate.stop()
         pump_on.stop()
-        controller.set_sp_loop1(0)
+        water_meter.close()
+        scheduler.submit(controller, controller.set_sp_loop1, 0, priority=WRITE, key=('sp', controller.address))
+        scheduler.close()
         self.worker_thread.quit()
+        self.worker_thread.wait()
 
     @pyqtSlot(list)
     def handle_files_from_widget(self, files: list[str]):
         self.files_to_process = files
-        self.run_btn.setDisabled(len(self.files_to_process) == 0)
-
-    def handle_update(self, commands: list[str]):
-        instr.write('VSET ' + commands[1])
-        instr.write('ISET ' + commands[2] + ' MA')
-        set_rate.write(int(commands[3]) / 60)
-        if commands[3] == 0:
-            pump_on.write(True)
+        self.program = None
+        if len(self.files_to_process) != 0:
+            #Programs are checked in full before they can be run, and kept compiled for the next time the file is opened
+            try:
+                self.program = compile_program(self.files_to_process[0], {name: limit[:2] for name, limit in setpoint_limits.items()}, cache_dir='.program_cache')
+            except (OSError, ProgramError) as e:
+                print(e)
+            else:
+                print("Program loaded: %d steps, %.0f s" % (len(self.program), self.program.duration))
+        self.run_btn.setDisabled(self.program is None)
+
+    #Only the setpoints that differ from the previous step are written, each bus on its own thread
+    def handle_update(self, commands: list[float]):
+        #updates the run emitted before it was cancelled may still be queued
+        if self.worker.cancelled:
+            return
+        dispatcher.dispatch(dict(zip(COLUMNS, commands[1:])))
+
+    #These slots receive samples from the instrument poller and only update the display
+    @pyqtSlot(object)
+    def show_power(self, sample):
+        self.V_Read.setText('%.2f V' % sample.voltage)
+        self.I_Read.setText('%.2f mA' % (sample.current * 1000))
+        self.Power_Calc.setText(str(round(sample.power, ndigits=4)))
+
+    @pyqtSlot(object)
+    def show_resistivity(self, sample):
+        self.resist_val.setText('%.2f' % sample.resistivity)
+
+    @pyqtSlot(object)
+    def show_temperature(self, sample):
+        self.temp_val_1.setText(str(sample.pv))
+
+    @pyqtSlot(object)
+    def show_cell_temperature(self, sample):
+        self.temp_val_2.setText(str(sample.pv))
+
+    @pyqtSlot(object)
+    def show_supply_event(self, event):
+        if event.faults:
+            print('Power supply fault: ' + ', '.join(event.faults))
         else:
-            pump_on.write(False)
-        controller.set_sp_loop1(float(commands[4]))
-        print("Beginning next step")
+            print('Power supply in ' + str(event.mode) + ' mode')
+
+    @pyqtSlot(str)
+    def show_error(self, message):
+        print(message)
+
+    @pyqtSlot(object)
+    def handle_step_report(self, report):
+        print("Step %d started at %.3f s, planned %.3f s (%+.1f ms)" % (report.index + 1, report.actual, report.planned, report.lateness * 1000))
 
     @pyqtSlot()
     def handle_finished(self):
         print(f"Program finished")
         self.worker_running = False
+        self.pause_btn.setChecked(False)
+        self.pause_btn.setEnabled(False)
 
     @pyqtSlot()
     def handle_started(self):
         print(f"Beginning program.")
         self.worker_running = True
+        self.pause_btn.setEnabled(True)
 
 class FileWindow(QMainWindow):
 
@@ -544,38 +707,33 @@ class FileWindow(QMainWindow):
         file_send = [files]
         self.signal_send_files_to_main.emit(file_send)
 
-def read_devices(device_list, instr):
-    with nidaqmx.Task(new_task_name="Resistivity") as task:
-        task.ai_channels.add_ai_voltage_chan(device_list["Water Meter"], max_val=10.0, min_val=0.0)
-        data_r = Decimal(value=(float(task.read()) * 2)).quantize(Decimal("0.00"))
-        window.resist_val.setText(str(data_r))
-
-    value_v = instr.query('VOUT?')
-    data_v = Decimal(value=(re.sub("[^0-9.]", "", value_v))).quantize(Decimal("0.00"))
-    window.V_Read.setText(str(data_v) + " V")
+#Pump flow rate in mL/min, written to the analog output and recorded with the samples
+def write_flow(rate):
+    set_rate.write(rate / 60)
+    poller.flow = rate
 
-    value_a = instr.query('IOUT?')
-    data_a = Decimal(value=(re.sub("[^0-9.]", "", value_a))).quantize(Decimal("0.00"))
-    window.I_Read.setText(str(data_a * 1000) + " mA")  
+#Pump flow rate and run line together; the pump is stopped at 0 mL/min
+def write_pump(flow):
+    write_flow(flow)
+    pump_on.write(flow == 0)
 
-    value_t = controller.get_pv_loop1()
-    window.temp_val_1.setText(str(value_t))
+#Every sample the poller put in the ring since the last call is logged, with the settings at the time of the call
+def datalog(reader, temp):
+    for t, v, i, p, r, heater_temp, cell_temp, flow in reader.read():
+        log_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) + '.%03d' % (t % 1 * 1000)
+        log.append([log_time, window.Running, v, i * 1000, p, r, flow, temp, heater_temp, cell_temp])
 
-    window.Power_Calc.setText(str(round((float(data_v) * float(data_a)), ndigits=4)))
-
-def datalog(V_Text, I_Text, P_Text, R_Text, Flow_Text, T_Text, df=pd.DataFrame()):
-    df_export = df
-    log_time = time.strftime("%Y-%m-%d %H:%M:%S")
-    log_dict = {'Time': log_time, 'System State': window.Running, 'Stack Voltage (V)': V_Text, 'Stack Current (mA)': I_Text, 'Stack Power (W)': P_Text, 'Water Resistivity (MΩ)': R_Text, 'Flow Rate (mL/min)': Flow_Text, 'Temperature (°C)': T_Text}
-    log_data = pd.DataFrame(data=log_dict, index=[0])
-    log_data.to_csv('elec_data.csv', mode='a', index=False, header=False)
-    print(time.strftime('%H:%M:%S') + ': Data logged')
+#Samples are archived in the run's store and rolled up to min/max/mean/last at 1 s, 1 min and 1 h next to them
+def archive(reader):
+    rows = reader.read()
+    store.append(rows)
+    rollups.append(rows)
 
 
 if __name__ == "__main__":
 
     try:
-        s = instr.query("ID?")
+        s = supply.identify()
         pass
     except ValueError:
         print("No power supply detected.")
@@ -585,25 +743,53 @@ if __name__ == "__main__":
     set_rate = pump_flow()
     pump_on.start()
     set_rate.start()
+
+    #Water meter sampled at 1 kHz, averaged over 0.2 s blocks to keep up with the poller
+    water_meter = WaterMeterStream(device_list["Water Meter"], rate=1000, block_size=200)
+    water_meter.start()
     
     app = QtWidgets.QApplication(sys.argv)
     window = UI_Setup()
     window.show()
 
-    timer_1 = QtCore.QTimer()
-    timer_1.timeout.connect(lambda: read_devices(device_list, instr))
-    timer_1.start(500)
-
-    #Set the file name to be saved by the system. Must be changed or previous file will be overwritten if it is in the directory.
-    try:
-        os.remove('elec_data.csv')
-    except OSError:
-        pass
-    log = pd.DataFrame(columns=['Time', 'System State', 'Stack Voltage (V)', 'Stack Current (mA)', 'Stack Power (W)', 'Water Resistivity (MΩ)', 'Flow Rate (mL/min)', 'Temperature (°C)'])
-    log.to_csv('elec_data.csv', mode='x', index=False, header=True)
+    #Instruments are read every 200 ms, each bus on its own thread in parallel, the window only renders the samples
+    #The power supply reports mode changes and faults by service request and is otherwise read back once a second
+    #Every cycle's values go into a ring holding the last 24 hours for logging and plotting
+    samples = SampleRing(InstrumentPoller.RING_COLUMNS, capacity=24 * 60 * 60 * 5)
+    poller = InstrumentPoller(supply, water_meter, controller, scheduler, cell=cell, interval=0.2, ring=samples)
+    poller.power_sample.connect(window.show_power)
+    poller.resistivity_sample.connect(window.show_resistivity)
+    poller.temperature_sample.connect(window.show_temperature)
+    poller.cell_temperature_sample.connect(window.show_cell_temperature)
+    poller.supply_event.connect(window.show_supply_event)
+    poller.error.connect(window.show_error)
+    poller.start()
+
+    #Program steps are written through the dispatcher, which skips unchanged setpoints and writes the buses in parallel
+    window.dispatch_error.connect(window.show_error)
+    dispatcher = SetpointDispatcher(error_callback=lambda e: window.dispatch_error.emit('Program step: ' + str(e)))
+    dispatcher.add_target(('voltage', 'current'), lambda voltage, current: supply.apply(voltage=voltage, current=current / 1000), bus=supply.resource_name)
+    dispatcher.add_target(('flow',), write_pump, bus='DAQ')
+    dispatcher.add_target(('temperature',), lambda temperature: scheduler.submit(controller, controller.set_sp_loop1, temperature, priority=WRITE, key=('sp', controller.address)).result(), bus=controller.serial.port)
+
+    #Live trends of the ring, from 10 minutes up to the full 24 hours it holds
+    window.tabs.addTab(TrendPlots(samples), 'Trends')
+
+    #Data is logged to elec_data_<start time>.csv, a new file is started every day and at 100 MB
+    log = TelemetryLogger('elec_data.csv', ['Time', 'System State', 'Stack Voltage (V)', 'Stack Current (mA)', 'Stack Power (W)', 'Water Resistivity (MΩ)', 'Flow Rate (mL/min)', 'Temperature (°C)', 'Heater Temperature (°C)', 'Cell Temperature (°C)'],
+                          max_bytes=100 * 1024 * 1024)
+    log_reader = samples.reader()
+
+    #The samples of every run are also kept in runs/<start time>, in Parquet chunks written every minute and merged
+    #into 10 minute files when the run closes
+    run_directory = os.path.join('runs', time.strftime('%Y%m%d-%H%M%S'))
+    store = RunStore(run_directory, InstrumentPoller.RING_COLUMNS)
+    rollups = RollupPipeline(run_directory, InstrumentPoller.RING_COLUMNS)
+    store_reader = samples.reader()
 
     timer_2 = QtCore.QTimer()
-    timer_2.timeout.connect(lambda: datalog(window.V_Read.text(), window.I_Read.text(), window.Power_Calc.text(), window.resist_val.text(), window.settings['Flow'], window.settings['Temp'], log))
-    timer_2.start(300 * 1000)
+    timer_2.timeout.connect(lambda: datalog(log_reader, window.settings['Temp']))
+    timer_2.timeout.connect(lambda: archive(store_reader))
+    timer_2.start(1000)
 
     sys.exit(app.exec())
\ No newline at end of file
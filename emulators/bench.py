@@ -0,0 +1,53 @@
+import numpy as np
+from emulators.latency import Latency
+from emulators.pump import PumpEmulator
+from emulators.pid import PIDEmulator
+from emulators.supply import SupplyEmulator, EmulatedResourceManager
+from emulators.daq import DAQEmulator
+
+
+class Bench(object):
+    '''
+    Every instrument of the electrolyzer emulated on this machine, with one latency setting
+
+    The serial instruments get the transfer time of their baud rate on top of delay and jitter. The water meter
+    reads a steady 18 MΩ with a little noise on its analog input. Each emulator uses its own seed derived from
+    seed, so runs with the same seed are repeatable.
+
+    Example::
+
+        with Bench(delay=0.005, jitter=0.002) as bench:
+            supply = PowerSupply(bench.resource_manager.open_resource('GPIB::8::INSTR'))
+            controller = OmegaPID(bench.heater.port, 247)
+    '''
+
+    SUPPLY = 'GPIB::8::INSTR'
+    WATER_METER = 'Dev1/ai6'
+
+    def __init__(self, delay=0.005, jitter=0.002, seed=None):
+        '''
+        :param float, delay: seconds every instrument takes to answer
+        :param float, jitter: largest random deviation from delay, in seconds
+        :param int, seed: seed of all the randomness, for repeatable runs
+        '''
+        seeds = np.random.SeedSequence(seed).generate_state(5)
+        self.supply = SupplyEmulator(self.SUPPLY, Latency(delay, jitter, seed=int(seeds[0])), back_emf=1.5)
+        self.resource_manager = EmulatedResourceManager({self.SUPPLY: self.supply})
+        self.pump = PumpEmulator(latency=Latency(delay, jitter, baudrate=19200, seed=int(seeds[1])))
+        self.heater = PIDEmulator('CN402', 247, Latency(delay, jitter, baudrate=19200, seed=int(seeds[2])))
+        self.cell = PIDEmulator('DTB', 1, Latency(delay, jitter, baudrate=19200, seed=int(seeds[3])))
+        noise = np.random.default_rng(int(seeds[4]))
+        self.daq = DAQEmulator(Latency(delay, jitter, seed=int(seeds[4])),
+                               signals={self.WATER_METER: lambda t: 9.0 + noise.normal(0.0, 0.01, len(t))})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.daq.uninstall()
+        self.resource_manager.close()
+        for emulator in (self.pump, self.heater, self.cell):
+            emulator.close()
@@ -0,0 +1,98 @@
+'''
+Throughput of the instrument drivers against the emulators, on any Linux machine
+
+    python -m emulators.benchmark --delay 0.005 --jitter 0.002 --seconds 5
+
+Each driver operation is repeated for the given time, and the calls per second, the mean, median and 99th
+percentile call time and the number of failed calls are printed. The emulated latency is the floor of every
+figure; what is above it is spent in the driver and the transport.
+'''
+import argparse
+import itertools
+import time
+import numpy as np
+import acquisition.water_meter
+from acquisition.water_meter import WaterMeterStream
+from control.pump import PeristalticPump
+from pid_control.heater import OmegaPID, DeltaPID
+from power_control.supply import PowerSupply
+from emulators.bench import Bench
+
+
+def measure(operation, seconds):
+    '''
+    Call operation repeatedly for seconds
+
+    :return: array of the seconds each successful call took, and the number of calls that raised
+    '''
+    durations = []
+    errors = 0
+    end = time.perf_counter() + seconds
+    while True:
+        start = time.perf_counter()
+        if start >= end:
+            break
+        try:
+            operation()
+        except Exception:
+            errors += 1
+            continue
+        durations.append(time.perf_counter() - start)
+    return np.array(durations), errors
+
+
+def report(name, result):
+    durations, errors = result
+    if not len(durations):
+        print('%-26s every call failed (%d)' % (name, errors))
+        return
+    milliseconds = durations * 1000
+    print('%-26s %7.1f /s  mean %7.2f ms  median %7.2f ms  p99 %7.2f ms  errors %d' % (
+        name, len(durations) / durations.sum(), milliseconds.mean(), np.median(milliseconds),
+        np.percentile(milliseconds, 99), errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the instrument drivers against the emulators')
+    parser.add_argument('--delay', type=float, default=0.005, help='seconds each instrument takes to answer')
+    parser.add_argument('--jitter', type=float, default=0.002, help='largest deviation from delay, seconds')
+    parser.add_argument('--seconds', type=float, default=3.0, help='time spent on each operation')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    with Bench(args.delay, args.jitter, args.seed) as bench:
+        supply = PowerSupply(bench.resource_manager.open_resource(Bench.SUPPLY))
+        voltages = itertools.cycle((10.0, 12.0))
+        report('PowerSupply.read', measure(supply.read, args.seconds))
+        report('PowerSupply.apply', measure(lambda: supply.apply(next(voltages), 0.5), args.seconds))
+
+        pump = PeristalticPump(bench.pump.port, cache_ttl=0)
+        rates = itertools.cycle((10.0, 20.0))
+        report('PeristalticPump.status', measure(pump.get_status, args.seconds))
+        report('PeristalticPump.configure', measure(
+            lambda: pump.configure(rate=next(rates), direction='dispense', volume=0), args.seconds))
+        pump.ser.close()
+
+        controller = OmegaPID(bench.heater.port, 247)
+        report('OmegaPID.read_snapshot', measure(controller.read_snapshot, args.seconds))
+        controller.serial.close()
+        cell = DeltaPID(bench.cell.port, 1)
+        # as set up in electro-control.py
+        cell.serial.baudrate = 19200
+        report('DeltaPID.read_snapshot', measure(cell.read_snapshot, args.seconds))
+        cell.serial.close()
+
+        # hardware-timed, so only the delivery rate can be checked
+        bench.daq.install(acquisition.water_meter)
+        delivered = []
+        meter = WaterMeterStream(Bench.WATER_METER, rate=1000, block_size=200,
+                                 callback=lambda value, block: delivered.append(time.perf_counter()))
+        with meter:
+            time.sleep(args.seconds)
+        intervals = np.diff(delivered)
+        print('%-26s %7.1f /s  expected %.1f /s  longest gap %.1f ms' % (
+            'WaterMeterStream blocks', 1 / intervals.mean(), meter.rate / meter.block_size, intervals.max() * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+from emulators.latency import Latency
+
+
+class DaqError(Exception):
+    '''
+    Raised where nidaqmx would raise nidaqmx.DaqError
+    '''
+
+    def __init__(self, message, error_code=-1, task_name=''):
+        super().__init__(message)
+        self.error_code = error_code
+        self.task_name = task_name
+
+
+class DAQEmulator(object):
+    '''
+    NI-DAQmx devices with the part of the nidaqmx task interface the drivers use
+
+    Analog inputs read a signal function per physical channel, which takes an array of time.time() sample times and
+    returns volts, clipped to the channel's range. A hardware-timed task started with a sample clock produces blocks
+    on absolute deadlines of the clock, fills its buffer and runs the every-n-samples callback registered on it, as
+    the driver's callback thread would; a consumer that falls more than a buffer behind gets the overrun error on its
+    next read. Analog and digital output writes take the device's latency and are kept in `outputs` by channel.
+
+    Drivers that call nidaqmx.Task and AnalogSingleChannelReader attach unchanged once install() has swapped those
+    names in their module for the emulator's. nidaqmx itself still has to be importable for its constants; the
+    package installs without NI-DAQmx, which is only needed to talk to real devices.
+
+    Example::
+
+        daq = DAQEmulator(signals={'Dev1/ai6': lambda t: np.full(len(t), 9.0)})
+        daq.install(acquisition.water_meter)
+        meter = WaterMeterStream('Dev1/ai6')
+    '''
+
+    # DAQmx error codes
+    OVERWRITE = -200279
+    TIMEOUT = -200284
+
+    def __init__(self, latency=None, signals=None):
+        '''
+        :param Latency, latency: time each output write takes
+        :param dict, signals: analog input channel to function of sample times returning volts; unlisted channels
+            read 0 V
+        '''
+        self.latency = Latency() if latency is None else latency
+        self.signals = dict(signals or {})
+        self.outputs = {}
+        self.writes = 0
+        # stands in for the nidaqmx module in a driver's namespace
+        self.module = SimpleNamespace(Task=self.Task, DaqError=DaqError)
+        self._installed = []
+
+    def Task(self, new_task_name=''):
+        return EmulatedTask(self, new_task_name)
+
+    def set_signal(self, channel, signal):
+        self.signals[channel] = signal
+
+    def sample(self, channel, times):
+        signal = self.signals.get(channel)
+        if signal is None:
+            return np.zeros(len(times))
+        return np.asarray(signal(times), dtype=np.float64)
+
+    def install(self, module):
+        '''
+        Point module's nidaqmx and AnalogSingleChannelReader, where it has them, at the emulator
+        '''
+        for name, replacement in (('nidaqmx', self.module), ('AnalogSingleChannelReader', AnalogSingleChannelReader)):
+            if hasattr(module, name):
+                self._installed.append((module, name, getattr(module, name)))
+                setattr(module, name, replacement)
+
+    def uninstall(self):
+        while self._installed:
+            module, name, original = self._installed.pop()
+            setattr(module, name, original)
+
+
+class _Channels(object):
+
+    def __init__(self, task):
+        self._task = task
+        self.names = []
+
+    def add_ai_voltage_chan(self, physical_channel, name_to_assign_to_channel='', terminal_config=None,
+                            min_val=-5.0, max_val=5.0, **kwargs):
+        self._add(physical_channel, (min_val, max_val))
+
+    def add_ao_voltage_chan(self, physical_channel, name_to_assign_to_channel='', min_val=-10.0, max_val=10.0,
+                            **kwargs):
+        self._add(physical_channel, (min_val, max_val))
+
+    def add_do_chan(self, lines, name_to_assign_to_lines='', line_grouping=None):
+        self._add(lines, None)
+
+    def _add(self, channel, limits):
+        self.names.append(channel)
+        self._task._limits[channel] = limits
+
+
+class _Timing(object):
+
+    def __init__(self):
+        self.rate = None
+        self.buffer_size = None
+
+    def cfg_samp_clk_timing(self, rate, source='', active_edge=None, sample_mode=None, samps_per_chan=1000):
+        self.rate = rate
+        self.buffer_size = samps_per_chan
+
+
+class EmulatedTask(object):
+    '''
+    A task of the DAQEmulator; create through DAQEmulator.Task, as nidaqmx.Task
+    '''
+
+    def __init__(self, daq, new_task_name=''):
+        self.daq = daq
+        self.name = new_task_name
+        self._limits = {}
+        self.ai_channels = _Channels(self)
+        self.ao_channels = _Channels(self)
+        self.do_channels = _Channels(self)
+        self.timing = _Timing()
+        self.in_stream = _InStream(self)
+        self._every_n = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def register_every_n_samples_acquired_into_buffer_event(self, sample_interval, callback_method):
+        self._every_n = (sample_interval, callback_method)
+
+    def start(self):
+        if self._thread is not None or not self.ai_channels.names or self.timing.rate is None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._acquire, name=f'DAQEmulator {self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def close(self):
+        self.stop()
+
+    def read(self, number_of_samples_per_channel=None, timeout=10.0):
+        '''
+        On-demand read of the analog inputs, one value per channel or a list of samples per channel
+        '''
+        count = 1 if number_of_samples_per_channel is None else number_of_samples_per_channel
+        if self.timing.rate is not None:
+            data = self.in_stream.take(count * len(self.ai_channels.names), timeout)
+            data = data.reshape(count, -1).T
+        else:
+            data = self._sample(np.full(count, time.time()))
+        values = [list(channel) for channel in data]
+        if number_of_samples_per_channel is None:
+            values = [channel[0] for channel in values]
+        return values[0] if len(values) == 1 else values
+
+    def write(self, data, auto_start=None, timeout=10.0):
+        '''
+        Write one value per output channel, or a single value to a task with one channel
+        '''
+        channels = self.ao_channels.names + self.do_channels.names
+        values = list(data) if isinstance(data, (list, tuple, np.ndarray)) else [data]
+        if len(values) != len(channels):
+            raise DaqError('Write of %d values to %d channels' % (len(values), len(channels)), task_name=self.name)
+        self.daq.latency.wait()
+        for channel, value in zip(channels, values):
+            limits = self._limits[channel]
+            if limits is not None and not limits[0] <= value <= limits[1]:
+                raise DaqError('%s: %g V is outside %g to %g V' % (channel, value, *limits), task_name=self.name)
+            self.daq.outputs[channel] = value
+        self.daq.writes += 1
+        return 1
+
+    def _sample(self, times):
+        rows = []
+        for channel in self.ai_channels.names:
+            low, high = self._limits[channel]
+            rows.append(np.clip(self.daq.sample(channel, times), low, high))
+        return np.array(rows)
+
+    def _acquire(self):
+        rate = self.timing.rate
+        block = self._every_n[0] if self._every_n is not None else max(int(rate / 10), 1)
+        start, start_time = time.monotonic(), time.time()
+        produced = 0
+        while True:
+            # each block is due once its last sample has been clocked in
+            if self._stop.wait(max(start + (produced + block) / rate - time.monotonic(), 0.0)):
+                return
+            times = start_time + (produced + np.arange(block)) / rate
+            # interleaved by sample, as DAQmx buffers them
+            self.in_stream.put(self._sample(times).T.ravel())
+            produced += block
+            if self._every_n is not None:
+                self._every_n[1](id(self), 1, block, None)
+
+
+class _InStream(object):
+    '''
+    The task's input buffer
+    '''
+
+    def __init__(self, task):
+        self._task = task
+        self._buffer = np.empty(0)
+        self._overwritten = False
+        self._condition = threading.Condition()
+
+    def put(self, samples):
+        with self._condition:
+            self._buffer = np.concatenate((self._buffer, samples))
+            size = self._task.timing.buffer_size
+            if size and len(self._buffer) > size * len(self._task.ai_channels.names):
+                self._buffer = self._buffer[-size * len(self._task.ai_channels.names):]
+                self._overwritten = True
+            self._condition.notify_all()
+
+    def take(self, count, timeout):
+        with self._condition:
+            if not self._condition.wait_for(lambda: len(self._buffer) >= count or self._overwritten, timeout):
+                raise DaqError('Read timed out with %d of %d samples available' % (len(self._buffer), count),
+                               DAQEmulator.TIMEOUT, self._task.name)
+            if self._overwritten:
+                self._overwritten = False
+                raise DaqError('Samples were overwritten before they were read', DAQEmulator.OVERWRITE,
+                               self._task.name)
+            samples, self._buffer = self._buffer[:count], self._buffer[count:]
+            return samples
+
+
+class AnalogSingleChannelReader(object):
+    '''
+    Stands in for nidaqmx.stream_readers.AnalogSingleChannelReader on an EmulatedTask's in_stream
+    '''
+
+    def __init__(self, task_in_stream):
+        self._in_stream = task_in_stream
+
+    def read_many_sample(self, data, number_of_samples_per_channel=None, timeout=10.0):
+        count = len(data) if number_of_samples_per_channel is None else number_of_samples_per_channel
+        data[:count] = self._in_stream.take(count, timeout)
+        return count
+
+    def read_one_sample(self, timeout=10):
+        return float(self._in_stream.take(1, timeout)[0])
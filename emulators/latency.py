@@ -0,0 +1,53 @@
+import random
+import time
+
+
+class Latency(object):
+    '''
+    Response time of an emulated instrument
+
+    Every exchange takes delay seconds plus a uniformly distributed jitter of up to ±jitter, never less than 0. With
+    a baudrate, the time the request and response bytes take on a serial line is added on top, at bits_per_char bits
+    per byte (10 for 8N1), so a long Modbus block read costs more than a short one, as it does on the wire.
+
+    Example::
+
+        latency = Latency(delay=0.005, jitter=0.002, baudrate=19200)
+        latency.wait(request_bytes=8, response_bytes=9)
+    '''
+
+    def __init__(self, delay=0.0, jitter=0.0, baudrate=None, bits_per_char=10, seed=None):
+        '''
+        :param float, delay: seconds the instrument takes to answer
+        :param float, jitter: largest random deviation from delay, in seconds
+        :param int, baudrate: serial line speed, or None to leave the transfer time out
+        :param int, bits_per_char: bits on the wire per byte, including start, parity and stop bits
+        :param seed: seed of the jitter, for repeatable runs
+        '''
+        if delay < 0 or jitter < 0:
+            raise ValueError('delay and jitter must not be negative')
+        self.delay = delay
+        self.jitter = jitter
+        self.baudrate = baudrate
+        self.bits_per_char = bits_per_char
+        self._random = random.Random(seed)
+
+    def __call__(self, request_bytes=0, response_bytes=0):
+        '''
+        Seconds one exchange takes
+
+        :param int, request_bytes: length of the request, for the transfer time
+        :param int, response_bytes: length of the response
+        '''
+        seconds = self.delay
+        if self.jitter:
+            seconds += self._random.uniform(-self.jitter, self.jitter)
+        if self.baudrate:
+            seconds += (request_bytes + response_bytes) * self.bits_per_char / self.baudrate
+        return max(seconds, 0.0)
+
+    def wait(self, request_bytes=0, response_bytes=0):
+        seconds = self(request_bytes, response_bytes)
+        if seconds:
+            time.sleep(seconds)
+        return seconds
@@ -0,0 +1,239 @@
+import math
+import random
+import struct
+import threading
+import time
+from emulators.serial_device import SerialDevice
+
+READ_HOLDING_REGISTERS = 3
+READ_INPUT_REGISTERS = 4
+WRITE_SINGLE_REGISTER = 6
+WRITE_MULTIPLE_REGISTERS = 16
+
+# Modbus exception codes
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+
+
+def crc16(data):
+    '''
+    Modbus RTU CRC of data, sent low byte first
+    '''
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def _crc_entry(byte):
+    crc = byte
+    for _ in range(8):
+        crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+_CRC_TABLE = [_crc_entry(byte) for byte in range(256)]
+
+
+class ModbusSlave(SerialDevice):
+    '''
+    Modbus RTU slave on a pseudo-terminal
+
+    RTU frames carry no length and are delimited on the line by silence, which a pty doesn't preserve, so requests
+    are cut from the incoming bytes by their function code instead: 8 bytes for functions 3, 4 and 6, and 9 plus
+    the byte count for function 16. A frame with a bad CRC is dropped a byte at a time until the stream lines up
+    again, and frames for other slave addresses are ignored, as on a shared RS-485 line; broadcasts to address 0
+    are executed without an answer. Registers are 16 bit and read as 0 until written. Every address exists unless
+    a subclass narrows that in mapped(), and reads of more than max_read registers are refused; both are answered
+    with the Modbus exception a device gives. Subclasses hook read_hook and write_hook to give registers behaviour.
+    '''
+
+    MAX_READ = 125
+    MAX_WRITE = 123
+
+    def __init__(self, slave_address, latency=None, name=None):
+        '''
+        :param int, slave_address: 1 to 247
+        :param Latency, latency: time each request takes to be answered
+        '''
+        self.slave_address = slave_address
+        self.max_read = self.MAX_READ
+        self.registers = {}
+        self.requests = 0
+        self._buffer = b''
+        self._lock = threading.Lock()
+        super().__init__(latency, name=name or f'ModbusSlave {slave_address}')
+
+    def receive(self, data):
+        self._buffer += data
+        while len(self._buffer) >= 8:
+            length = self._frame_length(self._buffer)
+            if length is None:
+                self._reject(self._buffer)
+                self._buffer = b''
+                return
+            if len(self._buffer) < length:
+                return
+            frame, rest = self._buffer[:length], self._buffer[length:]
+            if crc16(frame[:-2]) != struct.unpack('<H', frame[-2:])[0]:
+                self._buffer = self._buffer[1:]
+                continue
+            self._buffer = rest
+            address = frame[0]
+            if address not in (self.slave_address, 0):
+                continue
+            with self._lock:
+                self.requests += 1
+                pdu = self._execute(frame[1], frame[2:-2])
+            if address != 0:
+                response = bytes((address,)) + pdu
+                self.respond(frame, response + struct.pack('<H', crc16(response)))
+
+    def mapped(self, start, count):
+        '''
+        Whether registers start to start + count - 1 all exist
+        '''
+        return start + count <= 0x10000
+
+    def read_hook(self, start, count):
+        '''
+        Called before registers start to start + count - 1 are read
+        '''
+
+    def write_hook(self, register, value):
+        '''
+        Called after value was written to register
+        '''
+
+    def _reject(self, frame):
+        # an unknown function has no known length; it is answered once if addressed to this slave and dropped
+        if frame[0] == self.slave_address:
+            response = bytes((frame[0], frame[1] | 0x80, ILLEGAL_FUNCTION))
+            self.respond(frame, response + struct.pack('<H', crc16(response)))
+
+    @staticmethod
+    def _frame_length(buffer):
+        function = buffer[1]
+        if function in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS, WRITE_SINGLE_REGISTER):
+            return 8
+        if function == WRITE_MULTIPLE_REGISTERS:
+            return 9 + buffer[6]
+        return None
+
+    def _execute(self, function, data):
+        if function in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+            start, count = struct.unpack('>HH', data)
+            if not 1 <= count <= self.max_read:
+                return bytes((function | 0x80, ILLEGAL_DATA_VALUE))
+            if not self.mapped(start, count):
+                return bytes((function | 0x80, ILLEGAL_DATA_ADDRESS))
+            self.read_hook(start, count)
+            values = [self.registers.get(start + i, 0) for i in range(count)]
+            return struct.pack('>BB%dH' % count, function, 2 * count, *values)
+        if function == WRITE_SINGLE_REGISTER:
+            register, value = struct.unpack('>HH', data)
+            if not self.mapped(register, 1):
+                return bytes((function | 0x80, ILLEGAL_DATA_ADDRESS))
+            self.registers[register] = value
+            self.write_hook(register, value)
+            return bytes((function,)) + data
+        start, count, byte_count = struct.unpack('>HHB', data[:5])
+        if not 1 <= count <= self.MAX_WRITE or byte_count != 2 * count:
+            return bytes((function | 0x80, ILLEGAL_DATA_VALUE))
+        if not self.mapped(start, count):
+            return bytes((function | 0x80, ILLEGAL_DATA_ADDRESS))
+        for i, value in enumerate(struct.unpack('>%dH' % count, data[5:])):
+            self.registers[start + i] = value
+            self.write_hook(start + i, value)
+        return struct.pack('>BHH', function, start, count)
+
+
+class PIDEmulator(ModbusSlave):
+    '''
+    PID temperature controller heating a first-order thermal load, on the register map of one of MODELS
+
+    Each model has its own table of the PV, SP, output and status registers, the registers that exist and the most
+    registers one read may ask for, written from the vendor's Modbus map rather than taken from the drivers, so a
+    driver reading the wrong register or too many at once gets the exception the controller would answer with.
+    The process value approaches the setpoint exponentially with time_constant, but only a heater: below the
+    setpoint it heats, above it the load cools towards ambient. The output is proportional to the error over
+    proportional_band and the process value carries noise of up to ±noise. The model advances on every read, so it
+    runs as fast as the driver polls.
+
+    Example::
+
+        with PIDEmulator('CN402', 247, time_constant=30.0) as emulator:
+            controller = OmegaPID(emulator.port, 247)
+    '''
+
+    MODELS = {
+        # Omega CN402: PV, output 1 and alarm status from 1000, setpoint at 1200; register 0 is read to check the
+        # connection
+        'CN402': dict(pv=(1000, 1, True), sp=(1200, 1, True), output=(1001, 1, False), status=(1002, 0, False),
+                      registers=(range(0, 1), range(1000, 1003), range(1200, 1201)), max_read=125),
+        # Delta DTB: the parameter and status registers 0x1000 to 0x102F, at most 8 words per read
+        'DTB': dict(pv=(0x1000, 1, True), sp=(0x1001, 1, True), output=(0x1012, 1, False), status=(0x102A, 0, False),
+                    registers=(range(0x1000, 0x1030),), max_read=8),
+    }
+
+    def __init__(self, model, slave_address, latency=None, ambient=22.0, time_constant=60.0,
+                 proportional_band=10.0, noise=0.0, seed=None):
+        '''
+        :param str, model: one of MODELS
+        :param int, slave_address: 1 to 247
+        :param Latency, latency: time each request takes to be answered
+        :param float, ambient: °C the load starts at and cools to
+        :param float, time_constant: seconds for the load to cover 63 % of the way to its setpoint
+        :param float, proportional_band: °C of error for 100 % output
+        :param float, noise: largest random deviation of the process value, °C
+        :param seed: seed of the noise, for repeatable runs
+        '''
+        self.map = self.MODELS[model]
+        self.ambient = ambient
+        self.time_constant = time_constant
+        self.proportional_band = proportional_band
+        self.noise = noise
+        self._random = random.Random(seed)
+        self.temperature = ambient
+        self.setpoint = ambient
+        self.output = 0.0
+        self._updated = time.monotonic()
+        super().__init__(slave_address, latency, name=f'PIDEmulator {model} {slave_address}')
+        self.max_read = self.map['max_read']
+        self._store('sp', self.setpoint)
+        self._store('status', 0)
+        self.read_hook(0, 0)
+
+    def mapped(self, start, count):
+        return any(start in block and start + count - 1 in block for block in self.map['registers'])
+
+    def read_hook(self, start, count):
+        now = time.monotonic()
+        target = max(self.setpoint, self.ambient)
+        self.temperature = target + (self.temperature - target) * math.exp(-(now - self._updated) / self.time_constant)
+        self._updated = now
+        self.output = min(max((self.setpoint - self.temperature) / self.proportional_band * 100, 0.0), 100.0)
+        pv = self.temperature
+        if self.noise:
+            pv += self._random.uniform(-self.noise, self.noise)
+        self._store('pv', pv)
+        self._store('output', self.output)
+
+    def write_hook(self, register, value):
+        spec = self.map['sp']
+        if register == spec[0]:
+            # bring the load up to now before it starts heading for the new setpoint
+            self.read_hook(0, 0)
+            self.setpoint = _unscale(value, spec)
+
+    def _store(self, field, value):
+        register, decimals, signed = self.map[field]
+        self.registers[register] = int(round(value * 10 ** decimals)) & 0xFFFF
+
+
+def _unscale(raw, spec):
+    register, decimals, signed = spec
+    if signed and raw >= 0x8000:
+        raw -= 0x10000
+    return raw / 10 ** decimals
@@ -0,0 +1,219 @@
+import math
+import threading
+import time
+from emulators.serial_device import SerialDevice
+
+# mL per US fluid ounce, for the OZ and OM/OS units
+_OUNCE = 29.5735
+# rate units in mL/min and volume units in mL
+_RATE_UNITS = {'MM': 1.0, 'MS': 60.0, 'OM': _OUNCE, 'OS': 60.0 * _OUNCE}
+_VOLUME_UNITS = {'ML': 1.0, 'OZ': _OUNCE}
+_TRIGGERS = ('FT', 'FH', 'F2', 'LE', 'ST', 'T2', 'SP', 'P2')
+
+
+class _Pump(object):
+    '''
+    State of one pump on the chain. Rate and volumes are kept in mL/min and mL and converted to the pump's
+    units when answering.
+    '''
+
+    def __init__(self, alarm=None):
+        self.rate = 1.0
+        self.rate_unit = 'MM'
+        self.volume = 0.0           # volume to pump, 0 for no limit
+        self.volume_unit = 'ML'
+        self.direction = 'INF'
+        self.trigger = 'LE'
+        self.diameter = '3/16'
+        self.alarm = alarm          # <alarm type> answered once in place of the next response
+        self.running = False
+        self.dispensed = 0.0
+        self.withdrawn = 0.0
+        self._phase = 0.0           # volume pumped since RUN
+        self._since = None
+
+    @property
+    def status(self):
+        if not self.running:
+            return 'S'
+        return 'I' if self.direction == 'INF' else 'W'
+
+    def update(self, now):
+        '''
+        Add the volume pumped since the last update, stopping the pump once it has pumped the volume set
+        '''
+        if not self.running:
+            return
+        pumped = self.rate * (now - self._since) / 60
+        if self.volume and self._phase + pumped >= self.volume:
+            pumped = self.volume - self._phase
+            self.running = False
+        self._phase += pumped
+        if self.direction == 'INF':
+            self.dispensed += pumped
+        else:
+            self.withdrawn += pumped
+        self._since = now
+
+    def start(self, now):
+        self.running = True
+        self._phase = 0.0
+        self._since = now
+
+
+class PumpEmulator(SerialDevice):
+    '''
+    New Era NE-9000 peristaltic pump, or a daisy chain of them, speaking the RS-232 Basic mode protocol
+
+    Commands are <address><command> [<data>]<CR>, and every pump answers <STX><address><status>[<data>]<ETX> with its
+    two digit address, the status I, W or S, and the answer to a query, '?<error code>' for an error or, once after
+    power on when power_on_alarm is set, the 'A?R' reset alarm. Commands to addresses not on the chain get no answer.
+    Rate, volume, direction, trigger, the dispensed and withdrawn totals, units and the TTL input behave as on the
+    pump: a running pump accumulates volume at its rate and stops by itself once it has pumped the volume set.
+    Commands are handled one at a time in arrival order, each after the device's latency, so pipelined commands are
+    answered in order like on the real chain.
+
+    Example::
+
+        with PumpEmulator(latency=Latency(0.005, 0.002, baudrate=19200)) as emulator:
+            pump = PeristalticPump(emulator.port)
+    '''
+
+    VERSION = 'NE9000V3.928'
+    RATE_RANGE = (0.0, 2000.0)      # mL/min
+    VOLUME_RANGE = (0.0, 9999.0)    # mL
+
+    def __init__(self, addresses=(0,), latency=None, power_on_alarm=False):
+        '''
+        :param addresses: addresses of the pumps on the chain
+        :param Latency, latency: time each command takes to be answered
+        :param bool, power_on_alarm: answer the first command to each pump with the power interrupt alarm
+        '''
+        self.pumps = {address: _Pump('R' if power_on_alarm else None) for address in addresses}
+        # the TTL level on each pump's input, answered to IN 2
+        self.ttl = {address: False for address in addresses}
+        self.commands = 0
+        self._buffer = b''
+        self._lock = threading.Lock()
+        super().__init__(latency, name='PumpEmulator')
+
+    def receive(self, data):
+        self._buffer += data
+        while b'\r' in self._buffer:
+            line, self._buffer = self._buffer.split(b'\r', 1)
+            response = self.handle(line.decode('ascii', 'replace'))
+            if response is not None:
+                self.respond(line + b'\r', response.encode('ascii'))
+
+    def handle(self, line):
+        '''
+        Execute one command line without its <CR>
+
+        :return: the response frame, or None if no pump on the chain has the address
+        '''
+        line = line.strip()
+        digits = len(line) - len(line.lstrip('0123456789'))
+        address = int(line[:digits]) if digits else 0
+        pump = self.pumps.get(address)
+        if pump is None:
+            return None
+        with self._lock:
+            self.commands += 1
+            pump.update(time.monotonic())
+            if pump.alarm is not None:
+                alarm, pump.alarm = pump.alarm, None
+                return '\x02%02dA?%s\x03' % (address, alarm)
+            data = self._execute(address, pump, line[digits:].split())
+            return '\x02%02d%s%s\x03' % (address, pump.status, data)
+
+    def set_ttl(self, address, level):
+        self.ttl[address] = bool(level)
+
+    def _execute(self, address, pump, words):
+        if not words:
+            return ''
+        command, args = words[0].upper(), [word.upper() for word in words[1:]]
+        if command == 'RUN':
+            pump.start(time.monotonic())
+        elif command == 'STP':
+            if not pump.running:
+                return '?NA'
+            pump.running = False
+        elif command == 'RAT':
+            return self._quantity(pump, 'rate', 'rate_unit', _RATE_UNITS, self.RATE_RANGE, args)
+        elif command == 'VOL':
+            return self._quantity(pump, 'volume', 'volume_unit', _VOLUME_UNITS, self.VOLUME_RANGE, args)
+        elif command == 'DIR':
+            if not args:
+                return pump.direction
+            if args[0] == 'REV':
+                pump.direction = 'WDR' if pump.direction == 'INF' else 'INF'
+            elif args[0] in ('INF', 'WDR'):
+                pump.direction = args[0]
+            else:
+                return '?'
+        elif command == 'TRG':
+            if not args:
+                return pump.trigger
+            if args[0] not in _TRIGGERS:
+                return '?'
+            pump.trigger = args[0]
+        elif command == 'DIS':
+            scale = _VOLUME_UNITS[pump.volume_unit]
+            return 'I%sW%s%s' % (_number(pump.dispensed / scale), _number(pump.withdrawn / scale), pump.volume_unit)
+        elif command == 'CLD':
+            if args == ['INF']:
+                pump.dispensed = 0.0
+            elif args == ['WDR']:
+                pump.withdrawn = 0.0
+            else:
+                return '?'
+        elif command == 'DIA':
+            if not args:
+                return pump.diameter
+            pump.diameter = args[0]
+        elif command == 'IN':
+            return '1' if self.ttl[address] else '0'
+        elif command == 'VER':
+            return self.VERSION
+        elif command == '*RESET':
+            self.pumps[address] = _Pump()
+        elif command not in ('AL', 'BUZ'):
+            return '?'
+        return ''
+
+    @staticmethod
+    def _quantity(pump, name, unit_name, units, limits, args):
+        '''
+        RAT and VOL: a query, a unit change that converts the value, or a value with optional units
+        '''
+        unit = getattr(pump, unit_name)
+        if not args:
+            return _number(getattr(pump, name) / units[unit]) + unit
+        if args[0] in units:
+            setattr(pump, unit_name, args[0])
+            return ''
+        try:
+            value = float(args[0])
+        except ValueError:
+            return '?'
+        if len(args) > 1:
+            if args[1] not in units:
+                return '?'
+            unit = args[1]
+        value *= units[unit]
+        if not limits[0] <= value <= limits[1]:
+            return '?OOR'
+        setattr(pump, name, value)
+        setattr(pump, unit_name, unit)
+        return ''
+
+
+def _number(value):
+    '''
+    Format value with the pump's four significant digits and no exponent, e.g. 0.2500, 12.50 or 1500
+    '''
+    if value == 0:
+        return '0.000'
+    decimals = max(0, 3 - int(math.floor(math.log10(abs(value)))))
+    return '%.*f' % (decimals, value)
@@ -0,0 +1,71 @@
+import os
+import pty
+import select
+import threading
+import tty
+from emulators.latency import Latency
+
+
+class SerialDevice(object):
+    '''
+    Base class of the instruments emulated on a pseudo-terminal
+
+    The device holds the master end of a pty pair and `port` is the path of the slave end, e.g. '/dev/pts/3', which
+    pyserial opens like any serial port, so a driver attaches by being given port in place of 'COM7'. A reader thread
+    passes every chunk of bytes the driver writes to receive(), which subclasses implement and answer through
+    respond(). The baud rate and framing the driver sets on the port are accepted and ignored; a Latency with a
+    baudrate stands in for the time on the wire. Only available where the pty module is, i.e. not on Windows.
+    '''
+
+    # how long the reader thread waits for input before checking whether the device was closed
+    READ_POLL_INTERVAL = 0.05
+
+    def __init__(self, latency=None, name=None):
+        '''
+        :param Latency, latency: response time of the device, none by default
+        :param str, name: name of the reader thread
+        '''
+        self.latency = Latency() if latency is None else latency
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._reader = threading.Thread(target=self._read_loop, name=name or type(self).__name__, daemon=True)
+        self._reader.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def receive(self, data):
+        '''
+        Handle bytes written by the driver, in whatever pieces they arrive
+        '''
+        raise NotImplementedError
+
+    def respond(self, request, response):
+        '''
+        Send response after the latency of the exchange
+
+        :param bytes, request: the request answered, for its transfer time
+        :param bytes, response: bytes to send back
+        '''
+        self.latency.wait(len(request), len(response))
+        os.write(self._master, response)
+
+    def close(self):
+        if not self._running:
+            return
+        self._running = False
+        self._reader.join()
+        os.close(self._master)
+        # the slave end is held open until here so the master never reads EOF while the driver reopens the port
+        os.close(self._slave)
+
+    def _read_loop(self):
+        while self._running:
+            readable, _, _ = select.select([self._master], [], [], self.READ_POLL_INTERVAL)
+            if readable:
+                self.receive(os.read(self._master, 4096))
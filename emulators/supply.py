@@ -0,0 +1,345 @@
+import collections
+import threading
+import time
+from typing import NamedTuple
+from pyvisa import constants
+from pyvisa.errors import VisaIOError
+from emulators.latency import Latency
+
+# STS? register bits, as in power_control.supply.PowerSupply
+CV = 1
+CC = 2
+UNR = 4
+OV = 8
+OT = 16
+AC = 32
+FOLD = 64
+ERR = 128
+PON = 256
+RI = 512
+
+# serial poll status byte
+STB_FAU = 1     # fault register not empty
+STB_PON = 2     # power on
+STB_RDY = 4     # ready for a command
+STB_ERR = 32    # programming error
+STB_RQS = 64    # service requested
+
+# ERR? codes
+NO_ERROR = 0
+UNRECOGNIZED = 1
+BAD_NUMBER = 2
+OUT_OF_RANGE = 4
+
+
+class WaitResponse(NamedTuple):
+    '''
+    The part of pyvisa's WaitResponse the drivers use
+    '''
+    event_type: object
+    timed_out: bool
+
+
+class SupplyEmulator(object):
+    '''
+    HP6032A system power supply as a pyvisa message based resource, in the manner of a pyvisa-sim instrument
+
+    The object has the methods of the pyvisa resource the PowerSupply driver talks to, so the driver takes it in
+    place of rm.open_resource('GPIB::8::INSTR'). Messages may hold several commands separated by ';', and the
+    answers to all queries in a message are returned together as one reply, e.g. VOUT?;IOUT?;STS? reads back
+    '12.000;0.500;1'. The output drives a load of back_emf volts in series with load_resistance ohms, so the supply
+    sits in CV or CC mode depending on the setpoints. Status bits that set while unmasked by UNMASK latch in the
+    fault register, which FAULT? reads and clears; with SRQ 1 or 3 a fault requests service, which is queued as a
+    VISA service request event and released by the serial poll of read_stb. Protection faults can be raised from a
+    test with trip(). Every message written takes the device's latency; replies are then read without delay.
+
+    Example::
+
+        emulator = SupplyEmulator(latency=Latency(0.005, 0.002))
+        supply = PowerSupply(emulator)
+    '''
+
+    IDENTITY = 'HP6032A'
+    VOLTAGE_RANGE = (0.0, 61.425)   # V
+    CURRENT_RANGE = (0.0, 51.1875)  # A
+
+    def __init__(self, resource_name='GPIB0::8::INSTR', latency=None, load_resistance=1.0, back_emf=0.0):
+        '''
+        :param str, resource_name: name the resource reports
+        :param Latency, latency: time each message takes to be accepted
+        :param float, load_resistance: ohms
+        :param float, back_emf: volts the load takes before any current flows, e.g. an electrolysis cell's
+        '''
+        self.resource_name = resource_name
+        self.latency = Latency() if latency is None else latency
+        self.load_resistance = load_resistance
+        self.back_emf = back_emf
+        self.timeout = 2000             # ms, as on a pyvisa resource
+        self.messages = 0
+        self._lock = threading.RLock()
+        self._events = threading.Condition(self._lock)
+        self._replies = collections.deque()
+        self._event_queue = collections.deque()
+        self._events_enabled = False
+        self.reset()
+        # the supply comes up with PON set until cleared by CLR
+        self._status |= PON
+
+    def reset(self):
+        '''
+        Power-on settings: output on at 0 V and 0 A, nothing unmasked, no service requests
+        '''
+        with self._lock:
+            self.voltage_setpoint = 0.0
+            self.current_setpoint = 0.0
+            self.output = True
+            self.mask = 0
+            self.srq = 0
+            self.fault = 0
+            self.error = NO_ERROR
+            self._protection = 0
+            self._service_requested = False
+            self._status = self._compute_status()
+
+    def set_load(self, load_resistance=None, back_emf=None):
+        '''
+        Change the load, e.g. to move the supply from CV to CC
+        '''
+        with self._lock:
+            if load_resistance is not None:
+                self.load_resistance = load_resistance
+            if back_emf is not None:
+                self.back_emf = back_emf
+            self._update_status()
+
+    def trip(self, bit):
+        '''
+        Raise a protection fault, e.g. trip(OV); the output stays off until an RST or CLR command
+        '''
+        with self._lock:
+            self._protection |= bit
+            self._update_status()
+
+    #####################################################################
+    # pyvisa resource interface
+    #####################################################################
+
+    def write(self, message):
+        self.latency.wait(len(message), 0)
+        with self._lock:
+            self.messages += 1
+            replies = []
+            for command in message.strip().split(';'):
+                reply = self._execute(command.strip())
+                if reply is not None:
+                    replies.append(reply)
+            if replies:
+                self._replies.append(';'.join(replies))
+        return len(message)
+
+    def read(self):
+        with self._lock:
+            if self._replies:
+                return self._replies.popleft()
+        time.sleep(self.timeout / 1000)
+        raise VisaIOError(constants.StatusCode.error_timeout)
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def read_stb(self):
+        with self._lock:
+            stb = STB_RDY
+            if self.fault:
+                stb |= STB_FAU
+            if self._status & PON:
+                stb |= STB_PON
+            if self.error:
+                stb |= STB_ERR
+            if self._service_requested:
+                stb |= STB_RQS
+                self._service_requested = False
+            return stb
+
+    def enable_event(self, event_type, mechanism, context=None):
+        with self._lock:
+            self._events_enabled = True
+
+    def disable_event(self, event_type, mechanism):
+        with self._lock:
+            self._events_enabled = False
+            self._event_queue.clear()
+
+    def wait_on_event(self, in_event_type, timeout, capture_timeout=False):
+        '''
+        :param int, timeout: ms, or None to wait for ever
+        '''
+        with self._events:
+            if self._events.wait_for(lambda: self._event_queue, None if timeout is None else timeout / 1000):
+                return WaitResponse(self._event_queue.popleft(), False)
+        if capture_timeout:
+            return WaitResponse(in_event_type, True)
+        raise VisaIOError(constants.StatusCode.error_timeout)
+
+    def clear(self):
+        with self._lock:
+            self._replies.clear()
+
+    def close(self):
+        self.disable_event(constants.EventType.service_request, constants.EventMechanism.queue)
+
+    #####################################################################
+    # Instrument model
+    #####################################################################
+
+    @property
+    def voltage(self):
+        return self._output()[0]
+
+    @property
+    def current(self):
+        return self._output()[1]
+
+    def _output(self):
+        if not self.output or self._protection:
+            return 0.0, 0.0
+        current = max(self.voltage_setpoint - self.back_emf, 0.0) / self.load_resistance
+        if current > self.current_setpoint:
+            current = self.current_setpoint
+            voltage = min(self.back_emf + current * self.load_resistance, self.voltage_setpoint) if current else 0.0
+            return voltage, current
+        return self.voltage_setpoint, current
+
+    def _compute_status(self):
+        status = self._protection
+        if self.error:
+            status |= ERR
+        if self.output and not self._protection:
+            limited = max(self.voltage_setpoint - self.back_emf, 0.0) / self.load_resistance > self.current_setpoint
+            status |= CC if limited else CV
+        return status
+
+    def _update_status(self):
+        status = self._compute_status() | (self._status & PON)
+        # a bit that sets while unmasked latches in the fault register
+        rising = status & ~self._status & self.mask
+        self._status = status
+        if rising:
+            self.fault |= rising
+            if self.srq & 1:
+                self._request_service()
+
+    def _request_service(self):
+        self._service_requested = True
+        if self._events_enabled:
+            self._event_queue.append(constants.EventType.service_request)
+            self._events.notify_all()
+
+    def _execute(self, command):
+        if not command:
+            return None
+        words = command.upper().split()
+        name, args = words[0], words[1:]
+        if name == 'VOUT?':
+            return '%.3f' % self.voltage
+        if name == 'IOUT?':
+            return '%.4f' % self.current
+        if name == 'VSET?':
+            return '%.3f' % self.voltage_setpoint
+        if name == 'ISET?':
+            return '%.4f' % self.current_setpoint
+        if name == 'STS?':
+            return '%d' % self._status
+        if name == 'ACCUM?':
+            return '%d' % (self._status | self.fault)
+        if name == 'FAULT?':
+            fault, self.fault = self.fault, 0
+            return '%d' % fault
+        if name == 'UNMASK?':
+            return '%d' % self.mask
+        if name == 'ERR?':
+            error, self.error = self.error, NO_ERROR
+            self._update_status()
+            return '%d' % error
+        if name == 'ID?':
+            return self.IDENTITY
+        if name == 'CLR' or name == 'RST':
+            # RST clears the protection circuits, CLR also returns to the power-on settings
+            if name == 'CLR':
+                self.reset()
+            self._protection = 0
+            self._update_status()
+            return None
+        if name in ('VSET', 'ISET', 'OUT', 'UNMASK', 'SRQ'):
+            if len(args) != 1:
+                return self._fail(UNRECOGNIZED)
+            try:
+                value = float(args[0])
+            except ValueError:
+                if name == 'OUT' and args[0] in ('ON', 'OFF'):
+                    value = 1.0 if args[0] == 'ON' else 0.0
+                else:
+                    return self._fail(BAD_NUMBER)
+            return self._set(name, value)
+        return self._fail(UNRECOGNIZED)
+
+    def _set(self, name, value):
+        if name == 'VSET':
+            if not self.VOLTAGE_RANGE[0] <= value <= self.VOLTAGE_RANGE[1]:
+                return self._fail(OUT_OF_RANGE)
+            self.voltage_setpoint = value
+        elif name == 'ISET':
+            if not self.CURRENT_RANGE[0] <= value <= self.CURRENT_RANGE[1]:
+                return self._fail(OUT_OF_RANGE)
+            self.current_setpoint = value
+        elif name == 'OUT':
+            self.output = bool(value)
+        elif name == 'UNMASK':
+            self.mask = int(value)
+        else:
+            self.srq = int(value)
+            if self.srq & 1 and self.fault:
+                self._request_service()
+        self._update_status()
+        return None
+
+    def _fail(self, error):
+        self.error = error
+        self._update_status()
+        if self.srq & 2:
+            self._request_service()
+        return None
+
+
+class EmulatedResourceManager(object):
+    '''
+    Stand-in for pyvisa.ResourceManager handing out emulated instruments by resource name
+
+    Example::
+
+        rm = EmulatedResourceManager({'GPIB::8::INSTR': SupplyEmulator()})
+        supply = PowerSupply(rm.open_resource('GPIB::8::INSTR'))
+    '''
+
+    def __init__(self, resources):
+        '''
+        :param dict, resources: resource name to emulator
+        '''
+        self.resources = dict(resources)
+
+    def list_resources(self, query='?*::INSTR'):
+        return tuple(self.resources)
+
+    def open_resource(self, resource_name, **kwargs):
+        try:
+            resource = self.resources[resource_name]
+        except KeyError:
+            raise VisaIOError(constants.StatusCode.error_resource_not_found) from None
+        for name, value in kwargs.items():
+            setattr(resource, name, value)
+        return resource
+
+    def close(self):
+        for resource in self.resources.values():
+            resource.close()
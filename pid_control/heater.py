@@ -1,6 +1,147 @@
+import queue
+import time
+from typing import NamedTuple, Optional
 import minimalmodbus
 
-class OmegaPID(minimalmodbus.Instrument):
+
+class PIDSnapshot(NamedTuple):
+    '''
+    Values read from a PID controller in one poll. Fields that weren't read, or that the controller's register map
+    doesn't provide, are None.
+    '''
+    pv: float                   # process value, °C
+    sp: Optional[float]         # setpoint, °C
+    output: Optional[float]     # control output, %
+    status: Optional[int]       # raw alarm/status register
+    timestamp: float            # time.time() of the read
+
+
+class SetpointMismatchError(ValueError):
+    '''
+    A deferred setpoint read-back found a different value than was written
+    '''
+
+    def __init__(self, field, expected, actual):
+        self.field = field
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        return '%s read back as %s, expected %s' % (self.field, self.actual, self.expected)
+
+
+class PIDController(minimalmodbus.Instrument):
+    '''
+    Base class for the PID controllers, adding block reads of the registers listed in SNAPSHOT_REGISTERS
+
+    SNAPSHOT_REGISTERS maps each PIDSnapshot field to (register, number of decimals, signed), or None if the
+    controller has no such register. Registers close enough together are fetched with a single read_registers
+    call of at most MAX_BLOCK registers. read_snapshot only reads the blocks holding the fields asked for, PV by
+    default, which bring whatever shares them along for free; other blocks are only read while a deferred write to
+    one of their registers waits to be verified.
+
+    With verify='deferred', setpoint writes return as soon as the write is acknowledged instead of reading the
+    register back. The value written is checked against the next read_snapshot instead, and a mismatch is passed
+    to on_mismatch, or put on the mismatches queue if there is no callback, as a SetpointMismatchError.
+    '''
+
+    VERIFY_MODES = ('immediate', 'deferred')
+
+    SNAPSHOT_REGISTERS = {}
+
+    # registers up to this far apart are read in the same block; reading a few unused registers is cheaper than
+    # another RTU round trip
+    BLOCK_GAP = 4
+    # most registers the controller answers in one read; the Modbus limit unless the controller's is lower
+    MAX_BLOCK = 125
+
+    def __init__(self, portname, slaveaddress, verify='immediate', on_mismatch=None):
+        minimalmodbus.Instrument.__init__(self, portname, slaveaddress)
+        if verify not in self.VERIFY_MODES:
+            raise ValueError(f'verify must be one of {self.VERIFY_MODES}')
+        self.verify = verify
+        self.on_mismatch = on_mismatch
+        self.mismatches = queue.Queue()
+        self._blocks = self._snapshot_blocks()
+        # snapshot field -> value written but not yet read back
+        self._unverified = {}
+
+    def _snapshot_blocks(self):
+        '''
+        Group the snapshot registers into (start, count) blocks of at most MAX_BLOCK registers
+        '''
+        registers = sorted(spec[0] for spec in self.SNAPSHOT_REGISTERS.values() if spec is not None)
+        blocks = []
+        for register in registers:
+            if blocks:
+                start, count = blocks[-1]
+                if register - (start + count - 1) <= self.BLOCK_GAP and register - start < self.MAX_BLOCK:
+                    blocks[-1] = (start, register - start + 1)
+                    continue
+            blocks.append((register, 1))
+        return blocks
+
+    def read_snapshot(self, fields=('pv',)):
+        '''
+        Read the blocks holding fields, plus those with a deferred write to verify
+
+        :param tuple, fields: PIDSnapshot fields to read
+        :return: PIDSnapshot, with None for fields in blocks that weren't read, e.g. OmegaPID's SP between writes
+        '''
+        wanted = [self.SNAPSHOT_REGISTERS[field][0] for field in tuple(fields) + tuple(self._unverified)
+                  if self.SNAPSHOT_REGISTERS[field] is not None]
+        raw = {}
+        for start, count in self._blocks:
+            if not any(start <= register < start + count for register in wanted):
+                continue
+            for offset, value in enumerate(self.read_registers(start, count)):
+                raw[start + offset] = value
+        snapshot = PIDSnapshot(timestamp=time.time(), **{field: self._scale(raw, spec)
+                                                         for field, spec in self.SNAPSHOT_REGISTERS.items()})
+        if self._unverified:
+            self._verify(snapshot)
+        return snapshot
+
+    def _written(self, field, value, read_back):
+        '''
+        Finish a setpoint write: read the register back now, or leave it for the next snapshot
+
+        :param str, field: snapshot field the register is read into
+        :param float, value: value written, in the snapshot's units
+        :param read_back: function reading the register back
+        '''
+        if self.verify == 'immediate':
+            return read_back()
+        self._unverified[field] = value
+        return value
+
+    def _verify(self, snapshot):
+        for field, expected in list(self._unverified.items()):
+            actual = getattr(snapshot, field)
+            if actual is None:
+                continue
+            del self._unverified[field]
+            # values are equal to within the resolution of the register
+            decimals = self.SNAPSHOT_REGISTERS[field][1]
+            if abs(actual - expected) > 0.5 / 10 ** decimals:
+                error = SetpointMismatchError(field, expected, actual)
+                if self.on_mismatch is not None:
+                    self.on_mismatch(error)
+                else:
+                    self.mismatches.put(error)
+
+    @staticmethod
+    def _scale(raw, spec):
+        if spec is None or spec[0] not in raw:
+            return None
+        register, decimals, signed = spec
+        value = raw[register]
+        if signed and value >= 0x8000:
+            value -= 0x10000
+        return value / 10 ** decimals if decimals else value
+
+
+class OmegaPID(PIDController):
     '''
     Instrument class for Omega CN402-1114455-C4 PID controller
 
@@ -9,8 +150,16 @@ class OmegaPID(minimalmodbus.Instrument):
         * slaveaddress (int): instrument address in range of 1 to 247
     '''
 
-    def __init__(self, portname, slaveaddress):
-        minimalmodbus.Instrument.__init__(self, portname, slaveaddress)
+    # 1000 PV, 1001 output 1 (0.1 %), 1002 alarm status, read together; 1200 SP is a block of its own
+    SNAPSHOT_REGISTERS = {
+        'pv': (1000, 1, True),
+        'sp': (1200, 1, True),
+        'output': (1001, 1, False),
+        'status': (1002, 0, False),
+    }
+
+    def __init__(self, portname, slaveaddress, verify='immediate', on_mismatch=None):
+        PIDController.__init__(self, portname, slaveaddress, verify, on_mismatch)
 
     def status_check(self):
         self.read_register(0, 1)
@@ -21,11 +170,23 @@ class OmegaPID(minimalmodbus.Instrument):
     
     def set_sp_loop1(self, value):
         self.write_register(1200, value, 1)
-        return self.read_register(1200, 1)
+        return self._written('sp', value, lambda: self.read_register(1200, 1))
     
-class DeltaPID(minimalmodbus.Instrument):
-    def __init__(self, portname, slaveaddress):
-        minimalmodbus.Instrument.__init__(self, portname, slaveaddress)
+class DeltaPID(PIDController):
+
+    # 0x1000 PV and 0x1001 SV, read together, 0x1012 output 1 (0.1 %), 0x102A LED status (alarm and output bits)
+    SNAPSHOT_REGISTERS = {
+        'pv': (0x1000, 1, True),
+        'sp': (0x1001, 1, True),
+        'output': (0x1012, 1, False),
+        'status': (0x102A, 0, False),
+    }
+
+    # the DTB answers at most 8 words to a function 03 read
+    MAX_BLOCK = 8
+
+    def __init__(self, portname, slaveaddress, verify='immediate', on_mismatch=None):
+        PIDController.__init__(self, portname, slaveaddress, verify, on_mismatch)
 
     def status_check(self):
         self.read_register(0x1004, 1)
@@ -35,5 +196,6 @@ class DeltaPID(minimalmodbus.Instrument):
         return self.read_register(0x1000, 1)
     
     def set_sp(self, value):
+        # value is written in tenths of a degree and read back in degrees
         self.write_register(0x1001, value)
-        return self.read_register(0x1001, 1)
\ No newline at end of file
+        return self._written('sp', value / 10, lambda: self.read_register(0x1001, 1))
\ No newline at end of file
@@ -0,0 +1,214 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+# Transaction priorities, lower runs first. A transaction already on the wire is never interrupted, but a queued
+# setpoint write always goes before any queued poll.
+WRITE = 0
+READ = 1
+POLL = 2
+
+
+class ModbusScheduler(object):
+    '''
+    Order and coalesce the Modbus transactions of the PID controllers
+
+    Every transaction goes through the scheduler instead of calling the instrument directly. Instruments are grouped
+    by serial port, and each port gets one worker thread, so slaves sharing an RS-485 port never talk over each
+    other while controllers on different ports run in parallel. Queued transactions run by priority: setpoint
+    writes before reads, reads before periodic polls. A write to a register that already has a write queued
+    replaces its value, as does a transaction submitted with the key of one still queued, so only the latest
+    setpoint is sent.
+
+    Example::
+
+        scheduler = ModbusScheduler()
+        scheduler.add_poll(controller, 0.5, on_snapshot)
+        scheduler.write_register(controller, 1200, 65.0, 1)
+    '''
+
+    def __init__(self):
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def write_register(self, instrument, registeraddress, value, number_of_decimals=0, signed=False):
+        '''
+        Queue a write of a single register, replacing the value of a write to the same register that hasn't been
+        sent yet
+
+        :return: concurrent.futures.Future, resolved once the latest value for the register has been written
+        '''
+        def write(value):
+            instrument.write_register(registeraddress, value, number_of_decimals, signed=signed)
+        job = _Job(WRITE, write, (value,), key=('write', instrument.address, registeraddress))
+        return self._worker(instrument).put(job)
+
+    def submit(self, instrument, fn, *args, priority=READ, key=None):
+        '''
+        Queue any other transaction on instrument, e.g. submit(controller, controller.get_pv_loop1)
+
+        :param key: if given, a queued transaction with the same key is sent with these args instead of being
+            queued twice, e.g. key=('sp', controller.address) for setpoint writes; transactions sharing a key must
+            call the same fn
+        :return: concurrent.futures.Future with the return value of fn
+        '''
+        return self._worker(instrument).put(_Job(priority, fn, args, key=key))
+
+    def add_poll(self, instrument, interval, callback, read=None, error_callback=None):
+        '''
+        Read instrument every interval seconds at poll priority. A poll that is still queued when the next one is
+        due is not queued twice.
+
+        :param instrument: PIDController
+        :param float, interval: seconds between polls
+        :param callback: called from the port's worker thread with the result of each poll
+        :param read: function doing the poll, instrument.read_snapshot by default
+        :param error_callback: called with the exception of a failed poll
+        '''
+        read = instrument.read_snapshot if read is None else read
+        self._worker(instrument).add_poll(_Poll(instrument, interval, read, callback, error_callback))
+
+    def remove_polls(self, instrument):
+        self._worker(instrument).remove_polls(instrument)
+
+    def close(self):
+        '''
+        Stop all workers once the transactions already queued have run
+        '''
+        with self._lock:
+            workers, self._workers = list(self._workers.values()), {}
+        for worker in workers:
+            worker.stop()
+
+    def _worker(self, instrument):
+        port = instrument.serial.port
+        with self._lock:
+            worker = self._workers.get(port)
+            if worker is None:
+                worker = self._workers[port] = _PortWorker(port)
+            return worker
+
+
+class _Job(object):
+    __slots__ = ('priority', 'fn', 'args', 'key', 'futures')
+
+    def __init__(self, priority, fn, args=(), key=None):
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.futures = [Future()]
+
+    def run(self):
+        futures = [future for future in self.futures if future.set_running_or_notify_cancel()]
+        try:
+            result = self.fn(*self.args)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for future in futures:
+                future.set_result(result)
+
+
+class _Poll(object):
+
+    def __init__(self, instrument, interval, read, callback, error_callback):
+        self.instrument = instrument
+        self.interval = interval
+        self.read = read
+        self.callback = callback
+        self.error_callback = error_callback
+        self.due = time.monotonic()
+        self.queued = False
+
+    def run(self):
+        try:
+            result = self.read()
+        except Exception as e:
+            if self.error_callback is not None:
+                self.error_callback(e)
+        else:
+            self.callback(result)
+        finally:
+            self.queued = False
+
+
+class _PortWorker(object):
+    '''
+    Runs the queued transactions of one serial port in priority order
+    '''
+
+    def __init__(self, port):
+        self._queue = []
+        self._pending = {}
+        self._polls = []
+        self._order = itertools.count()
+        self._running = True
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f'ModbusScheduler {port}', daemon=True)
+        self._thread.start()
+
+    def put(self, job):
+        with self._condition:
+            queued = self._pending.get(job.key) if job.key is not None else None
+            if queued is not None:
+                # coalesce: the queued job sends the new value and answers both callers
+                queued.args = job.args
+                queued.futures.extend(job.futures)
+                return job.futures[0]
+            if job.key is not None:
+                self._pending[job.key] = job
+            heapq.heappush(self._queue, (job.priority, next(self._order), job))
+            self._condition.notify()
+        return job.futures[0]
+
+    def add_poll(self, poll):
+        with self._condition:
+            self._polls.append(poll)
+            self._condition.notify()
+
+    def remove_polls(self, instrument):
+        with self._condition:
+            self._polls = [poll for poll in self._polls if poll.instrument is not instrument]
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+
+    def _next(self):
+        '''
+        Wait for the next transaction to run, queueing polls as they fall due. Returns None once stopped.
+        '''
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = None
+                for poll in self._polls:
+                    if poll.queued:
+                        continue
+                    if poll.due <= now:
+                        poll.queued = True
+                        poll.due = max(poll.due + poll.interval, now)
+                        heapq.heappush(self._queue, (POLL, next(self._order), poll))
+                    else:
+                        wait = poll.due - now if wait is None else min(wait, poll.due - now)
+                if self._queue:
+                    job = heapq.heappop(self._queue)[2]
+                    if getattr(job, 'key', None) is not None:
+                        del self._pending[job.key]
+                    return job
+                if not self._running:
+                    return None
+                self._condition.wait(wait)
+
+    def _run(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            job.run()
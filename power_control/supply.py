@@ -0,0 +1,248 @@
+import re
+import threading
+import time
+from typing import NamedTuple
+from pyvisa.constants import EventMechanism, EventType
+
+
+class PowerSnapshot(NamedTuple):
+    '''
+    Output and status of the power supply from one readback
+    '''
+    voltage: float      # V
+    current: float      # A
+    status: int         # STS? register, see PowerSupply.STATUS_BITS
+    timestamp: float    # time.time() of the read
+
+    @property
+    def power(self):
+        return self.voltage * self.current
+
+    @property
+    def mode(self):
+        '''
+        'CV', 'CC' or None if the supply is in neither, e.g. output off or unregulated
+        '''
+        return _mode(self.status)
+
+
+class SupplyEvent(NamedTuple):
+    '''
+    A service request from the power supply
+    '''
+    status: int         # STS? register when the request was serviced
+    fault: int          # FAULT? register, the unmasked status bits that raised the request
+    timestamp: float    # time.time() the request was serviced
+
+    @property
+    def mode(self):
+        return _mode(self.status)
+
+    @property
+    def faults(self):
+        '''
+        Names of the fault bits, e.g. ['OV']
+        '''
+        return PowerSupply.describe_status(self.fault & ~(PowerSupply.CV | PowerSupply.CC))
+
+    def __str__(self):
+        return '%s mode, fault %s' % (self.mode or 'no regulation', ', '.join(PowerSupply.describe_status(self.fault)))
+
+
+def _mode(status):
+    if status & PowerSupply.CV:
+        return 'CV'
+    if status & PowerSupply.CC:
+        return 'CC'
+    return None
+
+
+class PowerSupply(object):
+    '''
+    Driver for the HP6032A system power supply on GPIB
+
+    Voltage, current and status are read back in one compound query instead of a transaction each, and parsed
+    straight to floats. The last commanded VSET and ISET are kept, so setting a value the supply already has sends
+    nothing, and setting both sends them in one message. All access is serialised, so the supply can be read from a
+    poll thread while the GUI writes setpoints.
+
+    Mode changes and faults don't have to be polled for. enable_service_requests unmasks the status bits of interest
+    and has the supply assert SRQ when one of them sets. A service thread waits on the VISA service request event,
+    reads the fault and status registers, and passes a SupplyEvent to the callback.
+
+    Example::
+
+        supply = PowerSupply(rm.open_resource('GPIB::8::INSTR'))
+        supply.apply(voltage=12.0, current=0.5)
+        snapshot = supply.read()
+    '''
+
+    # STS? register bits
+    CV = 1          # constant voltage
+    CC = 2          # constant current
+    UNR = 4         # unregulated
+    OV = 8          # overvoltage protection tripped
+    OT = 16         # overtemperature
+    AC = 32         # AC line dropout
+    FOLD = 64       # foldback protection tripped
+    ERR = 128       # programming error
+    PON = 256       # power on
+    RI = 512        # remote inhibit
+    STATUS_BITS = {
+        CV: 'CV', CC: 'CC', UNR: 'UNR', OV: 'OV', OT: 'OT', AC: 'AC', FOLD: 'FOLD', ERR: 'ERR', PON: 'PON', RI: 'RI',
+    }
+
+    # status bits that raise a service request by default: mode transitions and every protection fault
+    SERVICE_MASK = CV | CC | UNR | OV | OT | AC | FOLD | RI
+    # SRQ register: request service on a fault, not on programming errors or power-on
+    SRQ_ON_FAULT = 1
+
+    READBACK = 'VOUT?;IOUT?;STS?'
+    _NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[Ee][-+]?\d+)?')
+
+    def __init__(self, resource):
+        '''
+        :param resource: pyvisa resource of the supply, e.g. rm.open_resource('GPIB::8::INSTR')
+        '''
+        self.resource = resource
+        self.voltage_setpoint = None
+        self.current_setpoint = None
+        self._lock = threading.RLock()
+        self._service_thread = None
+        self._service_stop = threading.Event()
+
+    @property
+    def resource_name(self):
+        return self.resource.resource_name
+
+    def identify(self):
+        with self._lock:
+            return self.resource.query('ID?').strip()
+
+    def read(self):
+        '''
+        Voltage, current and status in one round trip
+
+        :return: PowerSnapshot
+        '''
+        with self._lock:
+            values = self._numbers(self.resource.query(self.READBACK))
+            # the reply may come as one message or one per query, depending on the interface's terminator settings
+            while len(values) < 3:
+                values += self._numbers(self.resource.read())
+        return PowerSnapshot(values[0], values[1], int(values[2]), time.time())
+
+    def set_voltage(self, voltage, force=False):
+        return self.apply(voltage=voltage, force=force)
+
+    def set_current(self, current, force=False):
+        '''
+        :param float, current: A
+        '''
+        return self.apply(current=current, force=force)
+
+    def apply(self, voltage=None, current=None, force=False):
+        '''
+        Send the setpoints that differ from the last ones commanded, both in one message
+
+        :param float, voltage: V, or None to leave unchanged
+        :param float, current: A, or None to leave unchanged
+        :param bool, force: send even if unchanged, e.g. to make sure the output is zeroed
+        :return: True if anything was sent
+        '''
+        commands = []
+        with self._lock:
+            if voltage is not None and (force or voltage != self.voltage_setpoint):
+                commands.append('VSET %.6g' % voltage)
+            if current is not None and (force or current != self.current_setpoint):
+                commands.append('ISET %.6g' % current)
+            if not commands:
+                return False
+            try:
+                self.resource.write(';'.join(commands))
+            except Exception:
+                # the supply may or may not have taken the values, make the next apply send them again
+                self.invalidate()
+                raise
+            if voltage is not None:
+                self.voltage_setpoint = voltage
+            if current is not None:
+                self.current_setpoint = current
+        return True
+
+    def zero(self):
+        '''
+        Command 0 V and 0 A, whatever was set before
+        '''
+        self.apply(0, 0, force=True)
+
+    def invalidate(self):
+        '''
+        Forget the commanded setpoints, e.g. after the supply was reset or set from its front panel
+        '''
+        with self._lock:
+            self.voltage_setpoint = None
+            self.current_setpoint = None
+
+    def enable_service_requests(self, callback, mask=None, error_callback=None, timeout=0.5):
+        '''
+        Have the supply request service when a status bit in mask sets, and report every request
+
+        :param callback: called from the service thread with a SupplyEvent for every request
+        :param int, mask: status bits that raise a request, SERVICE_MASK by default
+        :param error_callback: called from the service thread with the exception if servicing a request fails
+        :param float, timeout: seconds between checks of whether the service thread should stop
+        '''
+        if self._service_thread is not None:
+            return
+        mask = self.SERVICE_MASK if mask is None else mask
+        with self._lock:
+            self.resource.write('UNMASK %d;SRQ %d' % (mask, self.SRQ_ON_FAULT))
+            # FAULT? clears whatever latched before the mask was set
+            self.resource.query('FAULT?')
+            self.resource.enable_event(EventType.service_request, EventMechanism.queue)
+        self._service_stop.clear()
+        self._service_thread = threading.Thread(target=self._service, args=(callback, error_callback, timeout),
+                                                name='PowerSupply SRQ', daemon=True)
+        self._service_thread.start()
+
+    def disable_service_requests(self):
+        if self._service_thread is None:
+            return
+        self._service_stop.set()
+        self._service_thread.join()
+        self._service_thread = None
+        with self._lock:
+            self.resource.disable_event(EventType.service_request, EventMechanism.queue)
+            self.resource.write('SRQ 0')
+
+    def _service(self, callback, error_callback, timeout):
+        while not self._service_stop.is_set():
+            try:
+                response = self.resource.wait_on_event(EventType.service_request, int(timeout * 1000),
+                                                       capture_timeout=True)
+                if response.timed_out:
+                    continue
+                with self._lock:
+                    # the serial poll releases SRQ, reading FAULT? clears the fault register for the next request
+                    self.resource.read_stb()
+                    fault = int(self._numbers(self.resource.query('FAULT?'))[0])
+                    status = int(self._numbers(self.resource.query('STS?'))[0])
+            except Exception as e:
+                if error_callback is not None:
+                    error_callback(e)
+                # don't spin on a bus that keeps failing
+                self._service_stop.wait(timeout)
+                continue
+            callback(SupplyEvent(status, fault, time.time()))
+
+    @classmethod
+    def describe_status(cls, status):
+        '''
+        Names of the bits set in a status register value, e.g. ['CC', 'OV']
+        '''
+        return [name for bit, name in cls.STATUS_BITS.items() if status & bit]
+
+    @classmethod
+    def _numbers(cls, response):
+        return [float(n) for n in cls._NUMBER.findall(response)]
@@ -0,0 +1,152 @@
+import csv
+import hashlib
+import io
+import os
+from typing import NamedTuple
+import numpy as np
+from program.ramps import SHAPES
+
+# Setpoint columns of a program file, after the duration
+COLUMNS = ('voltage', 'current', 'flow', 'temperature')
+UNITS = ('V', 'mA', 'mL/min', '°C')
+
+# Bump when the compiled form or the checks change, so older cache entries are not used
+VERSION = 2
+
+
+class Program(NamedTuple):
+    '''
+    A program file parsed and checked once, as columns
+    '''
+    durations: np.ndarray   # seconds each row lasts
+    values: np.ndarray      # one row of COLUMNS setpoints per program row
+    shapes: np.ndarray      # SHAPES entry of every row
+    digest: str             # hash of the file content the program was compiled from
+
+    def __len__(self):
+        return len(self.durations)
+
+    @property
+    def duration(self):
+        '''
+        Total run time in seconds
+        '''
+        return float(self.durations.sum())
+
+
+class ProgramError(ValueError):
+    '''
+    A program file failed its checks; `problems` lists (line, message) for every bad row
+    '''
+
+    # problems listed in the message, the rest are only counted
+    SHOWN = 10
+
+    def __init__(self, path, problems):
+        self.path = path
+        self.problems = problems
+
+    def __str__(self):
+        lines = ['%s: %d problem%s' % (self.path, len(self.problems), '' if len(self.problems) == 1 else 's')]
+        lines += ['  line %d: %s' % problem for problem in self.problems[:self.SHOWN]]
+        if len(self.problems) > self.SHOWN:
+            lines.append('  ... and %d more' % (len(self.problems) - self.SHOWN))
+        return '\n'.join(lines)
+
+
+def compile_program(path, limits, cache_dir=None):
+    '''
+    Parse and check a program file, or load it from the cache if the same content was compiled before
+
+    Rows are duration (s), voltage, current, flow, temperature and an optional ramp shape, after a header line.
+    Every row is checked before anything runs: numbers parse and are finite, durations are positive, setpoints are
+    within limits and exponential ramps have positive ends. All problems are collected and raised together as a
+    ProgramError.
+
+    :param str, path: CSV program file
+    :param dict, limits: (low, high) of every COLUMNS entry, e.g. the ranges of the UI's validators
+    :param str, cache_dir: directory the compiled programs are kept in, keyed by content hash; no cache if None
+    :return: Program
+    '''
+    with open(path, 'rb') as file:
+        content = file.read()
+    key = hashlib.sha256(content)
+    key.update(repr((VERSION, sorted(limits.items()))).encode())
+    digest = key.hexdigest()
+    cached = None if cache_dir is None else os.path.join(cache_dir, digest + '.npz')
+    if cached is not None and os.path.exists(cached):
+        with np.load(cached) as data:
+            return Program(data['durations'], data['values'], data['shapes'], digest)
+
+    program = _compile(path, content.decode('utf-8-sig'), limits, digest)
+    if cached is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # written under a temporary name first, so a reader never loads a partial file
+        partial = cached + '.partial'
+        with open(partial, 'wb') as file:
+            np.savez(file, durations=program.durations, values=program.values, shapes=program.shapes)
+        os.replace(partial, cached)
+    return program
+
+
+def _compile(path, text, limits, digest):
+    reader = csv.reader(io.StringIO(text))
+    next(reader, None)
+    lines = []
+    rows = []
+    for row in reader:
+        if not any(field.strip() for field in row):
+            continue
+        lines.append(reader.line_num)
+        rows.append(row)
+    lines = np.array(lines, dtype=np.int64)
+    problems = []
+
+    names = ('duration',) + COLUMNS
+    numbers = np.full((len(rows), 1 + len(COLUMNS)), np.nan)
+    # cells that parsed as numbers; the rest are already reported and left NaN
+    parsed = np.zeros(numbers.shape, dtype=bool)
+    shapes = np.full(len(rows), 'step', dtype='<U6')
+    try:
+        # the fast path: every row is complete and numeric
+        numbers[:] = np.array([row[:1 + len(COLUMNS)] for row in rows], dtype=np.float64)
+        parsed[:] = True
+    except ValueError:
+        for i, row in enumerate(rows):
+            if len(row) < 1 + len(COLUMNS):
+                problems.append((lines[i], 'expected %d columns, found %d' % (1 + len(COLUMNS), len(row))))
+                continue
+            for j, field in enumerate(row[:1 + len(COLUMNS)]):
+                try:
+                    numbers[i, j] = float(field)
+                    parsed[i, j] = True
+                except ValueError:
+                    problems.append((lines[i], '%s is not a number: %r' % (names[j], field)))
+    # float() takes 'nan' and 'inf', which would pass every check below and reach the instruments
+    for i, j in zip(*np.nonzero(parsed & ~np.isfinite(numbers))):
+        problems.append((lines[i], '%s must be finite, found %r' % (names[j], rows[i][j].strip())))
+    for i, row in enumerate(rows):
+        if len(row) > 1 + len(COLUMNS):
+            shape = row[1 + len(COLUMNS)].strip().lower() or 'step'
+            if shape not in SHAPES:
+                problems.append((lines[i], 'unknown ramp %r, expected one of %s' % (shape, ', '.join(SHAPES))))
+            else:
+                shapes[i] = shape
+
+    durations, values = numbers[:, 0], numbers[:, 1:]
+    for i in np.flatnonzero(~(durations > 0) & np.isfinite(durations)):
+        problems.append((lines[i], 'duration must be positive, found %g' % durations[i]))
+    for j, (column, unit) in enumerate(zip(COLUMNS, UNITS)):
+        low, high = limits[column]
+        for i in np.flatnonzero(np.isfinite(values[:, j]) & ((values[:, j] < low) | (values[:, j] > high))):
+            problems.append((lines[i], '%s %g %s is outside %g to %g' % (column, values[i, j], unit, low, high)))
+    # an exponential ramp needs positive ends in every column that changes
+    previous = np.vstack((values[:1], values[:-1]))
+    changing = previous != values
+    bad = changing & ((previous <= 0) | (values <= 0))
+    for i in np.flatnonzero((shapes == 'exp') & bad.any(axis=1)):
+        problems.append((lines[i], 'an exponential ramp needs positive start and end values'))
+
+    if problems:
+        raise ProgramError(path, sorted(problems))
+    return Program(durations, values, shapes, digest)
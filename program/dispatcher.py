@@ -0,0 +1,114 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class SetpointDispatcher(object):
+    '''
+    Send only the setpoints that changed, writing to independent buses at the same time
+
+    Each target is a group of setpoint fields written by one function on one bus, e.g. voltage and current by the
+    power supply on GPIB. The dispatcher keeps the last values sent for every field. dispatch() compares a new set
+    of setpoints against them and queues a write only for the targets with a changed field. Every bus has its own
+    thread, so writes to different buses run concurrently while the writes to one bus stay in order, and dispatch()
+    returns without waiting for any of them. A write that fails forgets the values it was sending, so the next
+    dispatch sends them again. cancel() drops the writes still queued, e.g. before setting the instruments to a
+    safe state, so none of them can run after it; once closed, dispatch() sends nothing.
+
+    Example::
+
+        dispatcher = SetpointDispatcher()
+        dispatcher.add_target(('voltage', 'current'), supply_write, bus='GPIB')
+        dispatcher.add_target(('temperature',), heater_write, bus='COM7')
+        dispatcher.dispatch({'voltage': 12.0, 'current': 500.0, 'temperature': 60.0})
+    '''
+
+    def __init__(self, error_callback=None):
+        '''
+        :param error_callback: called from the bus's thread with the exception of a failed write
+        '''
+        self.error_callback = error_callback
+        self.applied = {}
+        self._targets = []
+        self._executors = {}
+        self._pending = set()
+        self.closed = False
+        # reentrant, since a future that is already done runs its done callback straight away
+        self._lock = threading.RLock()
+
+    def add_target(self, fields, write, bus):
+        '''
+        :param tuple, fields: setpoint fields written together
+        :param write: function taking the fields as keyword arguments
+        :param bus: hashable naming the bus write talks on; writes on the same bus never overlap
+        '''
+        self._targets.append((tuple(fields), write, bus))
+        if bus not in self._executors:
+            self._executors[bus] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'SetpointDispatcher {bus}')
+
+    def dispatch(self, setpoints):
+        '''
+        Queue the writes of every target with a field that differs from what was last sent
+
+        :param dict, setpoints: field to value; targets with a field missing here are left alone
+        :return: list of concurrent.futures.Future, one per write queued; empty once closed
+        '''
+        futures = []
+        with self._lock:
+            if self.closed:
+                return futures
+            for fields, write, bus in self._targets:
+                if not all(field in setpoints for field in fields):
+                    continue
+                values = {field: setpoints[field] for field in fields}
+                if all(field in self.applied and self.applied[field] == value for field, value in values.items()):
+                    continue
+                self.applied.update(values)
+                future = self._executors[bus].submit(self._write, fields, write, values)
+                self._pending.add(future)
+                future.add_done_callback(self._done)
+                futures.append(future)
+        return futures
+
+    def reset(self):
+        '''
+        Forget what was sent, e.g. after the instruments were set some other way, so the next dispatch sends everything
+        '''
+        with self._lock:
+            self.applied.clear()
+
+    def cancel(self):
+        '''
+        Drop the writes still queued and wait for those already on the bus; dropped values are sent again by the
+        next dispatch
+        '''
+        with self._lock:
+            pending = list(self._pending)
+            self.applied.clear()
+        running = [future for future in pending if not future.cancel()]
+        wait(running)
+
+    def close(self):
+        '''
+        Drop the queued writes, wait for those already on the bus and stop the bus threads
+        '''
+        with self._lock:
+            self.closed = True
+        self.cancel()
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _write(self, fields, write, values):
+        try:
+            write(**values)
+        except Exception as e:
+            with self._lock:
+                for field, value in values.items():
+                    if self.applied.get(field) == value:
+                        del self.applied[field]
+            if self.error_callback is not None:
+                self.error_callback(e)
+            raise
@@ -0,0 +1,80 @@
+import numpy as np
+
+# How a program row reaches its values: 'step' sets them at the start of the row, 'linear' and 'exp' ramp from the
+# previous row's values to the row's own over the row's duration. 'exp' is a geometric ramp, constant in ratio
+# rather than in difference per second, for values that span decades.
+SHAPES = ('step', 'linear', 'exp')
+
+
+def trajectory(start, end, duration, rate, shape):
+    '''
+    Setpoints of one ramp, sampled at rate per second
+
+    The ramp is split into n = ceil(duration * rate) equal intervals and sampled at their n + 1 boundaries, so the
+    last tick lands exactly on the end values at the end of the row.
+
+    :param start: values at the start of the ramp, one per column
+    :param end: values at the end of the ramp
+    :param float, duration: seconds
+    :param float, rate: setpoint updates per second
+    :param str, shape: 'linear' or 'exp'
+    :return: (tick durations, values with one row per tick)
+    '''
+    start = np.asarray(start, dtype=np.float64)
+    end = np.asarray(end, dtype=np.float64)
+    n = max(int(np.ceil(duration * rate)), 1)
+    fraction = (np.arange(n + 1) / n)[:, None]
+    if shape == 'linear':
+        values = start + (end - start) * fraction
+    elif shape == 'exp':
+        changing = start != end
+        if np.any(changing & ((start <= 0) | (end <= 0))):
+            raise ValueError('An exponential ramp needs positive start and end values')
+        ratio = np.ones_like(start)
+        ratio[changing] = end[changing] / start[changing]
+        values = start * ratio ** fraction
+    else:
+        raise ValueError(f'shape must be one of {SHAPES[1:]}')
+    durations = np.full(n + 1, duration / n)
+    # the final tick sets the end values exactly as the next row is due
+    durations[-1] = 0.0
+    return durations, values
+
+
+def expand(durations, values, shapes, rate=1.0):
+    '''
+    Expand a program's rows into the ticks sent to the instruments
+
+    Step rows become one tick, ramp rows the ticks of their trajectory. A ramp in the first row starts from its own
+    values, since there is nothing before it. The zero-length end tick of a ramp is left out when another row
+    follows, as that row's first tick is due at the same time: a step overwrites the end values straight away, and
+    a ramp starts by sending them.
+
+    :param durations: seconds each row lasts
+    :param values: 2D array of setpoints, one row per program row
+    :param shapes: SHAPES entry of every row
+    :param float, rate: setpoint updates per second during ramps
+    :return: (tick durations, tick values, index of the program row each tick belongs to)
+    '''
+    durations = np.asarray(durations, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    tick_durations = []
+    tick_values = []
+    tick_rows = []
+    for i, shape in enumerate(shapes):
+        if shape == 'step':
+            ticks, trajectory_values = durations[i:i + 1], values[i:i + 1]
+        else:
+            start = values[i - 1] if i else values[i]
+            try:
+                ticks, trajectory_values = trajectory(start, values[i], durations[i], rate, shape)
+            except ValueError as e:
+                raise ValueError(f'Row {i + 1}: {e}') from None
+            if i + 1 < len(shapes):
+                ticks, trajectory_values = ticks[:-1], trajectory_values[:-1]
+        tick_durations.append(ticks)
+        tick_values.append(trajectory_values)
+        tick_rows.append(np.full(len(ticks), i))
+    if not tick_durations:
+        return np.empty(0), np.empty((0, values.shape[1] if values.ndim == 2 else 0)), np.empty(0, dtype=int)
+    return np.concatenate(tick_durations), np.concatenate(tick_values), np.concatenate(tick_rows)
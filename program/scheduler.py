@@ -0,0 +1,128 @@
+import threading
+import time
+from typing import NamedTuple
+import numpy as np
+
+
+class StepReport(NamedTuple):
+    '''
+    When a program step started, in seconds of program time: time since the start, not counting pauses
+    '''
+    index: int
+    planned: float
+    actual: float
+
+    @property
+    def lateness(self):
+        return self.actual - self.planned
+
+
+class StepScheduler(object):
+    '''
+    Start the steps of a program on absolute deadlines
+
+    Step i is due at the sum of the durations before it, measured on the monotonic clock from the start of the run,
+    so the time spent handling a step never pushes the later ones back: a late step only shortens itself. Durations
+    can be fractions of a second. The wait between steps can be cancelled, paused and resumed from any thread and
+    reacts at once; time spent paused is added to every remaining deadline, so a resumed step runs for what was left
+    of it. The planned and actual start of every step is kept in `planned` and `actual`, and reported to on_report.
+
+    Example::
+
+        scheduler = StepScheduler([10, 0.5, 30], on_step=lambda i: apply(rows[i]))
+        threading.Thread(target=scheduler.run).start()
+        scheduler.pause()
+    '''
+
+    def __init__(self, durations, on_step, on_report=None):
+        '''
+        :param durations: seconds each step lasts
+        :param on_step: called from the running thread with the index of each step as it starts
+        :param on_report: called with the StepReport of each step, after on_step
+        '''
+        self.durations = np.asarray(durations, dtype=np.float64)
+        if np.any(self.durations < 0):
+            raise ValueError('Step durations must not be negative')
+        self.on_step = on_step
+        self.on_report = on_report
+        self.offsets = np.concatenate(([0.0], np.cumsum(self.durations)))
+        self.planned = self.offsets[:-1]
+        self.actual = np.full(len(self.durations), np.nan)
+        self.cancelled = False
+        self.paused = False
+        self._start = None
+        self._paused_total = 0.0
+        self._paused_at = None
+        self._condition = threading.Condition()
+
+    @property
+    def duration(self):
+        return self.offsets[-1]
+
+    def elapsed(self):
+        '''
+        Program time since the start of the run, not counting pauses
+        '''
+        with self._condition:
+            if self._start is None:
+                return 0.0
+            now = self._paused_at if self.paused else time.monotonic()
+            return now - self._start - self._paused_total
+
+    def run(self):
+        '''
+        Run every step, blocking until the last one has lasted its duration or the run is cancelled
+
+        :return: True if the program ran to the end
+        '''
+        with self._condition:
+            self._start = time.monotonic()
+            if self.paused:
+                # paused before the run started: the pause counts from the start
+                self._paused_at = self._start
+        for i in range(len(self.durations)):
+            if not self._wait(self.offsets[i]):
+                return False
+            actual = self.elapsed()
+            self.actual[i] = actual
+            self.on_step(i)
+            if self.on_report is not None:
+                self.on_report(StepReport(i, self.planned[i], actual))
+        return self._wait(self.offsets[-1])
+
+    def cancel(self):
+        with self._condition:
+            self.cancelled = True
+            self._condition.notify_all()
+
+    def pause(self):
+        with self._condition:
+            if not self.paused:
+                self.paused = True
+                self._paused_at = time.monotonic()
+                self._condition.notify_all()
+
+    def resume(self):
+        with self._condition:
+            if self.paused:
+                self._paused_total += time.monotonic() - self._paused_at
+                self.paused = False
+                self._paused_at = None
+                self._condition.notify_all()
+
+    def reports(self):
+        return [StepReport(i, self.planned[i], self.actual[i]) for i in range(len(self.actual))
+                if not np.isnan(self.actual[i])]
+
+    def _wait(self, offset):
+        with self._condition:
+            while True:
+                if self.cancelled:
+                    return False
+                if self.paused:
+                    self._condition.wait()
+                    continue
+                remaining = self._start + self._paused_total + offset - time.monotonic()
+                if remaining <= 0:
+                    return True
+                self._condition.wait(remaining)
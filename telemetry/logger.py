@@ -0,0 +1,137 @@
+import csv
+import io
+import os
+import threading
+import time
+
+
+class TelemetryLogger(object):
+    '''
+    Append rows to a CSV log with the file kept open and the rows buffered in memory
+
+    Rows are formatted and written in batches: as soon as flush_rows rows are waiting, and otherwise at most
+    flush_interval seconds after they were appended, by a background thread. Each batch is one write and, with fsync,
+    one fsync, so logging every sample costs little more than logging one every few minutes.
+
+    Every file starts with the header and is named after the path with the time it was opened, e.g.
+    elec_data_20250301-142500.csv. A new file is started when the current one reaches max_bytes, and with
+    rotate_daily at the first flush after midnight.
+
+    Example::
+
+        with TelemetryLogger('elec_data.csv', ['Time', 'Voltage (V)']) as log:
+            log.append([time.time(), 12.0])
+    '''
+
+    def __init__(self, path, columns, flush_rows=500, flush_interval=5.0, fsync=True, max_bytes=None,
+                 rotate_daily=True):
+        '''
+        :param str, path: base name of the log files
+        :param list, columns: header row
+        :param int, flush_rows: rows buffered before they are written
+        :param float, flush_interval: most seconds a row is buffered before it is written
+        :param bool, fsync: fsync every batch, so a crash loses at most the rows still buffered
+        :param int, max_bytes: size at which a new file is started, no limit if None
+        :param bool, rotate_daily: start a new file every day
+        '''
+        self.stem, self.suffix = os.path.splitext(path)
+        self.columns = list(columns)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.path = None
+        self._file = None
+        self._day = None
+        self._rows = []
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name='TelemetryLogger', daemon=True)
+        self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def append(self, row):
+        '''
+        :param row: values in column order
+        '''
+        with self._lock:
+            if self._closed.is_set():
+                raise ValueError('Logger is closed')
+            self._rows.append(row)
+            full = len(self._rows) >= self.flush_rows
+        if full:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the buffered rows now
+        '''
+        with self._io_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+            text = io.StringIO()
+            csv.writer(text).writerows(rows)
+            try:
+                self._rotate_if_due()
+                self._file.write(text.getvalue())
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except OSError:
+                # keep the rows for the next attempt rather than losing them
+                with self._lock:
+                    self._rows[:0] = rows
+                raise
+
+    def close(self):
+        '''
+        Write what is buffered and close the file
+        '''
+        if self._closed.is_set():
+            return
+        with self._lock:
+            self._closed.set()
+        self._flusher.join()
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _rotate_if_due(self):
+        if self._file is not None:
+            full = self.max_bytes is not None and self._file.tell() >= self.max_bytes
+            if not full and not (self.rotate_daily and time.strftime('%Y%m%d') != self._day):
+                return
+            file, self._file = self._file, None
+            file.close()
+        self._open()
+
+    def _open(self):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = f'{self.stem}_{stamp}{self.suffix}'
+        n = 1
+        while os.path.exists(path):
+            # rotated twice within a second
+            path = f'{self.stem}_{stamp}_{n}{self.suffix}'
+            n += 1
+        self._file = open(path, 'x', newline='', encoding='utf-8')
+        self._day = stamp[:8]
+        self.path = path
+        csv.writer(self._file).writerow(self.columns)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print('Telemetry log: ' + str(e))
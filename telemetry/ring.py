@@ -0,0 +1,117 @@
+import threading
+import numpy as np
+
+
+class SampleRing(object):
+    '''
+    Fixed-capacity buffer of numeric samples, one row of float64 columns per sample
+
+    Rows are written into a preallocated numpy array, overwriting the oldest once the ring is full, so memory stays
+    bounded however long a run is. Each consumer reads through its own RingReader, which returns the rows appended
+    since its last read, so the logger, the plots and anything else can all read the same samples at their own pace.
+    Missing values are NaN.
+
+    Example::
+
+        ring = SampleRing(['time', 'voltage', 'current'], capacity=432000)
+        ring.append([time.time(), 12.0, 0.5])
+        voltage = ring.column('voltage', 100)
+    '''
+
+    def __init__(self, columns, capacity):
+        '''
+        :param list, columns: column names, in row order
+        :param int, capacity: rows kept
+        '''
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self._data = np.full((capacity, len(self.columns)), np.nan)
+        # rows ever appended; the next row goes to _total % capacity
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._total, self.capacity)
+
+    @property
+    def total(self):
+        '''
+        Number of rows appended since the ring was created, including ones overwritten since
+        '''
+        return self._total
+
+    def append(self, row):
+        with self._lock:
+            self._data[self._total % self.capacity] = row
+            self._total += 1
+
+    def extend(self, rows):
+        '''
+        Append a 2D array of rows, oldest first
+        '''
+        rows = np.asarray(rows, dtype=np.float64)
+        appended = len(rows)
+        # rows that would be overwritten within this call are skipped
+        rows = rows[-self.capacity:]
+        with self._lock:
+            first = (self._total + appended - len(rows)) % self.capacity
+            count = min(len(rows), self.capacity - first)
+            self._data[first:first + count] = rows[:count]
+            self._data[:len(rows) - count] = rows[count:]
+            self._total += appended
+
+    def latest(self, n=None):
+        '''
+        Copy of the last n rows, oldest first, or of every row kept if n is None
+        '''
+        with self._lock:
+            count = len(self) if n is None else min(n, len(self))
+            return self._rows(self._total - count, self._total)
+
+    def column(self, name, n=None):
+        return self.latest(n)[:, self.index[name]]
+
+    def since(self, position):
+        '''
+        Rows appended after position, a previous value of total
+
+        :return: (rows, total), rows only go back as far as the ring does
+        '''
+        with self._lock:
+            start = max(position, self._total - self.capacity)
+            return self._rows(start, self._total), self._total
+
+    def reader(self):
+        '''
+        A RingReader starting from the next row appended
+        '''
+        return RingReader(self)
+
+    def _rows(self, start, stop):
+        first = start % self.capacity
+        count = stop - start
+        if first + count <= self.capacity:
+            return self._data[first:first + count].copy()
+        return np.concatenate((self._data[first:], self._data[:first + count - self.capacity]))
+
+
+class RingReader(object):
+    '''
+    One consumer's position in a SampleRing
+    '''
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.position = ring.total
+        # rows overwritten before this reader got to them
+        self.missed = 0
+
+    def read(self):
+        '''
+        Rows appended since the last read, oldest first
+        '''
+        rows, total = self.ring.since(self.position)
+        self.missed += total - self.position - len(rows)
+        self.position = total
+        return rows
@@ -0,0 +1,146 @@
+import os
+import numpy as np
+from telemetry.store import RunStore, RunReader
+
+
+class Rollup(object):
+    '''
+    Streaming min/max/mean/last of every column over consecutive time buckets
+
+    Rows are folded into fixed buckets of resolution seconds as they arrive, a batch at a time with numpy reductions,
+    and each bucket is passed to the sink as one row once a later row shows it is complete. Min and max keep spikes
+    that a mean alone would hide. NaNs are ignored by every statistic: last is the bucket's last non-NaN value.
+
+    Output rows are 'time' (the bucket's start), 'count' (rows in the bucket), then <column>_min, <column>_max,
+    <column>_mean and <column>_last for every input column after 'time'.
+    '''
+
+    STATISTICS = ('min', 'max', 'mean', 'last')
+
+    def __init__(self, columns, resolution, sink):
+        '''
+        :param list, columns: input column names, the first is 'time'
+        :param float, resolution: bucket width in seconds
+        :param sink: called with a 2D array of completed bucket rows
+        '''
+        self.columns = tuple(columns)
+        self.resolution = resolution
+        self.sink = sink
+        self.output_columns = ('time', 'count') + tuple(f'{name}_{statistic}' for name in self.columns[1:]
+                                                        for statistic in self.STATISTICS)
+        # the open bucket: id, rows, and per column min, max, sum, non-NaN count and last
+        self._bucket = None
+        self._open = None
+
+    def append(self, rows):
+        '''
+        :param rows: 2D array of rows in column order with increasing time
+        '''
+        rows = np.asarray(rows, dtype=np.float64)
+        if not len(rows):
+            return
+        buckets = np.floor(rows[:, 0] / self.resolution)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        values = rows[:, 1:]
+        missing = np.isnan(values)
+        # row of the last non-NaN value of every column in every bucket, -1 where the bucket has none
+        last = np.maximum.reduceat(np.where(missing, -1, np.arange(len(rows))[:, None]), starts)
+        groups = [
+            np.diff(np.r_[starts, len(rows)]),
+            np.fmin.reduceat(values, starts),
+            np.fmax.reduceat(values, starts),
+            np.add.reduceat(np.where(missing, 0.0, values), starts),
+            np.add.reduceat((~missing).astype(np.float64), starts),
+            np.where(last >= 0, values[last, np.arange(values.shape[1])], np.nan),
+        ]
+        ids = buckets[starts]
+        if self._bucket is not None:
+            if ids[0] == self._bucket:
+                groups = self._merge(groups)
+            else:
+                self._emit(np.array([self._bucket]), [value[None] for value in self._open])
+        # every bucket but the last is complete
+        self._emit(ids[:-1], [group[:-1] for group in groups])
+        self._bucket = ids[-1]
+        self._open = [group[-1] for group in groups]
+
+    def flush(self):
+        '''
+        Pass the open bucket to the sink as it is, e.g. at the end of a run
+        '''
+        if self._bucket is not None:
+            self._emit(np.array([self._bucket]), [value[None] for value in self._open])
+            self._bucket = None
+            self._open = None
+
+    def _merge(self, groups):
+        count, low, high, total, valid, last = groups
+        open_count, open_low, open_high, open_total, open_valid, open_last = self._open
+        count, low, high, total, valid, last = (count.copy(), low.copy(), high.copy(), total.copy(), valid.copy(),
+                                                 last.copy())
+        count[0] += open_count
+        low[0] = np.fmin(low[0], open_low)
+        high[0] = np.fmax(high[0], open_high)
+        total[0] += open_total
+        valid[0] += open_valid
+        # the open bucket's last value stands where the new rows have none
+        last[0] = np.where(np.isnan(last[0]), open_last, last[0])
+        return [count, low, high, total, valid, last]
+
+    def _emit(self, ids, groups):
+        if not len(ids):
+            return
+        count, low, high, total, valid, last = groups
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / valid
+        statistics = np.stack((low, high, mean, last), axis=-1).reshape(len(ids), -1)
+        self.sink(np.column_stack((ids * self.resolution, count, statistics)))
+
+
+class RollupPipeline(object):
+    '''
+    Rollups of a run's samples at several resolutions, stored next to the raw data
+
+    Each resolution is kept in its own RunStore in the run's directory, rollup_<seconds>s, so a dashboard over a long
+    window reads the coarse rollup with RunReader instead of every raw sample.
+
+    Example::
+
+        rollups = RollupPipeline('runs/20250301-142500', ['time', 'voltage'])
+        rollups.append(rows)
+        hourly = rollups.reader(3600).read(['voltage_max'])
+    '''
+
+    def __init__(self, directory, columns, resolutions=(1, 60, 3600)):
+        '''
+        :param str, directory: the run's directory
+        :param list, columns: input column names, the first is 'time'
+        :param resolutions: bucket widths in seconds
+        '''
+        self.directory = directory
+        self.rollups = {}
+        self.stores = {}
+        for resolution in resolutions:
+            # written as often as the raw samples, and merged into files of 600 buckets, but at least 10 minutes and
+            # at most a day, when the run closes
+            merge_seconds = min(max(600 * resolution, 600), 24 * 60 * 60)
+            rollup = Rollup(columns, resolution, None)
+            store = RunStore(self.path(resolution), rollup.output_columns, merge_seconds=merge_seconds)
+            rollup.sink = store.append
+            self.rollups[resolution] = rollup
+            self.stores[resolution] = store
+
+    def path(self, resolution):
+        return os.path.join(self.directory, 'rollup_%gs' % resolution)
+
+    def append(self, rows):
+        for rollup in self.rollups.values():
+            rollup.append(rows)
+
+    def reader(self, resolution):
+        return RunReader(self.path(resolution))
+
+    def close(self):
+        for resolution, rollup in self.rollups.items():
+            rollup.flush()
+            self.stores[resolution].close()
@@ -0,0 +1,212 @@
+import csv
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class RunStore(object):
+    '''
+    Columnar, chunked storage of one run's numeric samples
+
+    Rows are buffered in memory and written as compressed Parquet chunk files once they span chunk_seconds of
+    samples or number chunk_rows, so a crash or power loss loses at most that much of the run. Chunks are split
+    into row groups of row_group_rows carrying per-column min/max statistics. Every chunk is listed with its time
+    range in the run's index.csv, so a reader opens only the chunks overlapping the time range it wants, reads only
+    the columns it asks for, and skips row groups outside the range. When the store is closed, consecutive chunks
+    are merged into files spanning up to merge_seconds, so a long run doesn't stay spread over many small files.
+
+    The first column must be 'time', in seconds since the epoch and increasing.
+
+    Example::
+
+        store = RunStore('runs/20250301-142500', ['time', 'voltage', 'current'])
+        store.append(rows)
+        store.close()
+        data = RunReader('runs/20250301-142500').read(['voltage'], start=t0, end=t0 + 3600)
+    '''
+
+    INDEX = 'index.csv'
+
+    def __init__(self, directory, columns, chunk_seconds=60.0, chunk_rows=100000, merge_seconds=600.0,
+                 row_group_rows=1000, compression='zstd'):
+        '''
+        :param str, directory: directory of the run, created if missing
+        :param list, columns: column names, the first is 'time'
+        :param float, chunk_seconds: span of samples buffered before they are written as a chunk file
+        :param int, chunk_rows: number of rows buffered before they are written as a chunk file
+        :param float, merge_seconds: span of the files chunks are merged into on close, or None to keep them as
+            written
+        :param int, row_group_rows: rows per row group within a chunk
+        :param str, compression: Parquet compression codec
+        '''
+        if columns[0] != 'time':
+            raise ValueError("The first column must be 'time'")
+        self.directory = directory
+        self.columns = tuple(columns)
+        self.chunk_seconds = chunk_seconds
+        self.chunk_rows = chunk_rows
+        self.merge_seconds = merge_seconds
+        self.row_group_rows = row_group_rows
+        self.compression = compression
+        self.schema = pa.schema([(name, pa.float64()) for name in self.columns])
+        self._blocks = []
+        self._buffered = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def append(self, rows):
+        '''
+        :param rows: 2D array of rows in column order, e.g. from a RingReader
+        '''
+        rows = np.asarray(rows, dtype=np.float64)
+        if not len(rows):
+            return
+        self._blocks.append(rows)
+        self._buffered += len(rows)
+        if self._buffered >= self.chunk_rows or rows[-1, 0] - self._blocks[0][0, 0] >= self.chunk_seconds:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the buffered rows as a chunk now
+        '''
+        if not self._buffered:
+            return
+        rows = np.concatenate(self._blocks)
+        self._blocks = []
+        self._buffered = 0
+        start, end = float(rows[0, 0]), float(rows[-1, 0])
+        name = 'chunk_%.3f.parquet' % start
+        table = pa.Table.from_arrays([pa.array(rows[:, i]) for i in range(len(self.columns))], schema=self.schema)
+        self._write_chunk(table, name)
+        # a chunk is only listed once it is complete, so readers never open a partly written file
+        with open(os.path.join(self.directory, self.INDEX), 'a', newline='') as index:
+            if index.tell() == 0:
+                csv.writer(index).writerow(['file', 'start', 'end', 'rows'])
+            csv.writer(index).writerow([name, repr(start), repr(end), len(rows)])
+            index.flush()
+            os.fsync(index.fileno())
+
+    def merge(self):
+        '''
+        Merge consecutive chunks into files spanning up to merge_seconds and list those in the index instead
+
+        The index is replaced in one step after the merged files are written, so a crash part way leaves either the
+        old chunks or the merged ones listed, never a mix; chunks replaced by a merged file are deleted afterwards.
+        A reader opened before the merge has to be refreshed.
+        '''
+        groups = []
+        for chunk in RunReader(self.directory).chunks:
+            if groups and chunk[2] - groups[-1][0][1] <= self.merge_seconds:
+                groups[-1].append(chunk)
+            else:
+                groups.append([chunk])
+        if all(len(group) == 1 for group in groups):
+            return
+        chunks, replaced = [], []
+        for group in groups:
+            if len(group) == 1:
+                chunks.append(group[0])
+                continue
+            start, end = group[0][1], group[-1][2]
+            name = 'chunk_%.3f_%.3f.parquet' % (start, end)
+            self._write_chunk(pa.concat_tables([pq.read_table(os.path.join(self.directory, chunk[0]))
+                                                for chunk in group]), name)
+            chunks.append((name, start, end, sum(chunk[3] for chunk in group)))
+            replaced.extend(chunk[0] for chunk in group)
+        path = os.path.join(self.directory, self.INDEX)
+        with open(path + '.tmp', 'w', newline='') as index:
+            writer = csv.writer(index)
+            writer.writerow(['file', 'start', 'end', 'rows'])
+            for name, start, end, rows in chunks:
+                writer.writerow([name, repr(start), repr(end), rows])
+            index.flush()
+            os.fsync(index.fileno())
+        os.replace(path + '.tmp', path)
+        for name in replaced:
+            os.remove(os.path.join(self.directory, name))
+
+    def close(self):
+        self.flush()
+        if self.merge_seconds is not None:
+            self.merge()
+
+    def _write_chunk(self, table, name):
+        pq.write_table(table, os.path.join(self.directory, name), row_group_size=self.row_group_rows,
+                       compression=self.compression)
+
+
+class RunReader(object):
+    '''
+    Read columns and time ranges of a run written by RunStore
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.chunks = []
+        self.refresh()
+
+    @property
+    def start(self):
+        return self.chunks[0][1] if self.chunks else None
+
+    @property
+    def end(self):
+        return self.chunks[-1][2] if self.chunks else None
+
+    def refresh(self):
+        '''
+        Reload the index, picking up chunks written since the reader was opened
+        '''
+        path = os.path.join(self.directory, RunStore.INDEX)
+        if not os.path.exists(path):
+            # nothing written yet
+            self.chunks = []
+            return
+        with open(path, newline='') as index:
+            self.chunks = [(row['file'], float(row['start']), float(row['end']), int(row['rows']))
+                           for row in csv.DictReader(index)]
+        self.chunks.sort(key=lambda chunk: chunk[1])
+
+    def read(self, columns=None, start=None, end=None):
+        '''
+        :param list, columns: columns to load, all of them if None; 'time' is always included
+        :param float, start: earliest time to load, from the beginning of the run if None
+        :param float, end: latest time to load, to the end of the run if None
+        :return: dict of column name to numpy array
+        '''
+        if columns is not None:
+            columns = ['time'] + [name for name in columns if name != 'time']
+        low = -np.inf if start is None else start
+        high = np.inf if end is None else end
+        tables = []
+        for name, chunk_start, chunk_end, rows in self.chunks:
+            if chunk_end < low or chunk_start > high:
+                continue
+            chunk = pq.ParquetFile(os.path.join(self.directory, name))
+            # time is the first column; its row group statistics say which groups overlap the range
+            metadata = chunk.metadata
+            groups = []
+            for group in range(metadata.num_row_groups):
+                statistics = metadata.row_group(group).column(0).statistics
+                if statistics.max >= low and statistics.min <= high:
+                    groups.append(group)
+            tables.append(chunk.read_row_groups(groups, columns=columns))
+        if not tables:
+            names = columns if columns is not None else self._columns()
+            return {name: np.empty(0) for name in names}
+        table = pa.concat_tables(tables)
+        time = table.column('time').to_numpy()
+        first, last = np.searchsorted(time, low, 'left'), np.searchsorted(time, high, 'right')
+        return {name: table.column(name).to_numpy()[first:last] for name in table.column_names}
+
+    def _columns(self):
+        if not self.chunks:
+            return ['time']
+        return pq.read_schema(os.path.join(self.directory, self.chunks[0][0])).names
@@ -0,0 +1,121 @@
+import time
+import numpy as np
+import pyqtgraph as pg
+from PyQt6 import QtCore, QtWidgets
+from telemetry.ring import SampleRing
+from telemetry.rollup import Rollup
+
+
+class TrendPlots(QtWidgets.QWidget):
+    '''
+    Live trend plots of the sample ring, decimated to the plots' pixel width
+
+    The visible window is split into one bucket per pixel column, and each bucket is drawn as a vertical stroke from
+    its minimum to its maximum, so spikes stay visible however many samples fall into a pixel. Buckets are kept up
+    to date incrementally: each refresh folds only the rows appended since the last one into a Rollup, and the
+    bucket still filling is drawn from its raw samples. Every refresh draws about two points per pixel per curve,
+    whether the window holds a thousand samples or millions. The buckets are rebuilt from the ring only when the
+    window or the plot width changes.
+    '''
+
+    # title, unit, and (column, pen, scale) of every curve
+    PLOTS = (
+        ('Stack Voltage', 'V', (('voltage', 'y', 1),)),
+        ('Stack Current', 'mA', (('current', 'c', 1000),)),
+        ('Stack Power', 'W', (('power', 'm', 1),)),
+        ('Water Resistivity', 'MΩ', (('resistivity', 'g', 1),)),
+        ('Flow Rate', 'mL/min', (('flow', 'w', 1),)),
+        ('Temperature', '°C', (('temperature', 'r', 1), ('cell_temperature', (255, 150, 0), 1))),
+    )
+    WINDOWS = {
+        '10 min': 10 * 60,
+        '1 h': 60 * 60,
+        '6 h': 6 * 60 * 60,
+        '24 h': 24 * 60 * 60,
+    }
+    COLUMNS = 2
+
+    def __init__(self, ring, window='1 h', refresh=0.5, parent=None):
+        '''
+        :param SampleRing, ring: samples with a 'time' column and the columns in PLOTS
+        :param str, window: initial key of WINDOWS
+        :param float, refresh: seconds between redraws
+        '''
+        super().__init__(parent)
+        self.ring = ring
+        self.window = self.WINDOWS[window]
+        self._width = None
+
+        self.window_box = QtWidgets.QComboBox()
+        self.window_box.addItems(self.WINDOWS)
+        self.window_box.setCurrentText(window)
+        self.window_box.currentTextChanged.connect(lambda text: self.set_window(self.WINDOWS[text]))
+
+        self.graphics = pg.GraphicsLayoutWidget()
+        self.curves = []
+        first = None
+        for i, (title, unit, curves) in enumerate(self.PLOTS):
+            plot = self.graphics.addPlot(row=i // self.COLUMNS, col=i % self.COLUMNS, title=title,
+                                         axisItems={'bottom': pg.DateAxisItem()})
+            plot.setLabel('left', units=unit)
+            plot.setClipToView(True)
+            if first is None:
+                first = plot
+            else:
+                plot.setXLink(first)
+            for column, pen, scale in curves:
+                self.curves.append((plot.plot(pen=pen), column, scale))
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.window_box)
+        layout.addWidget(self.graphics)
+        self.setLayout(layout)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(int(refresh * 1000))
+
+    def set_window(self, seconds):
+        self.window = seconds
+        self._width = None
+
+    def refresh(self):
+        width = max(self.graphics.width() // self.COLUMNS, 100)
+        if width != self._width:
+            self._rebuild(width)
+        else:
+            self._add(self._reader.read())
+        self._draw()
+
+    def _rebuild(self, width):
+        self._width = width
+        self._resolution = self.window / width
+        self._rollup = Rollup(self.ring.columns, self._resolution, lambda rows: self._buckets.extend(rows))
+        self._buckets = SampleRing(self._rollup.output_columns, 2 * width + 2)
+        self._tail = np.empty((0, len(self.ring.columns)))
+        # all rows still in the ring, then whatever is appended after them
+        rows, total = self.ring.since(0)
+        self._reader = self.ring.reader()
+        self._reader.position = total
+        self._add(rows[rows[:, 0] >= time.time() - self.window])
+
+    def _add(self, rows):
+        if not len(rows):
+            return
+        self._rollup.append(rows)
+        # raw rows of the bucket the rollup hasn't completed yet
+        rows = np.concatenate((self._tail, rows))
+        start = np.floor(rows[-1, 0] / self._resolution) * self._resolution
+        self._tail = rows[rows[:, 0] >= start]
+
+    def _draw(self):
+        buckets = self._buckets.latest()
+        buckets = buckets[buckets[:, 0] >= time.time() - self.window]
+        x = np.concatenate((np.repeat(buckets[:, 0] + self._resolution / 2, 2), self._tail[:, 0]))
+        for curve, column, scale in self.curves:
+            low = buckets[:, self._buckets.index[column + '_min']]
+            high = buckets[:, self._buckets.index[column + '_max']]
+            y = np.concatenate((np.column_stack((low, high)).ravel(), self._tail[:, self.ring.index[column]]))
+            # instruments read less often than every cycle leave NaN rows and buckets; the line joins their samples
+            finite = np.isfinite(y)
+            curve.setData(x[finite], y[finite] * scale)